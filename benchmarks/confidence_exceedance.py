@@ -0,0 +1,116 @@
+"""Validation of the analytic DSWFP confidence layer against the Monte Carlo simulation it replaced.
+A NumPy port of `workflows.dswfp._uniform_sum_exceedance` is compared with the 100-draw `calc_confidence`
+scheme previously used by `export_daily_surface_water` and with a Monte Carlo of many more draws that
+converges to the exact probability. Synthetic pixels cover regular intervals, zero-width intervals of one
+or both models and masked inputs (NaN), which need to stay masked. The Monte Carlo estimates have a standard error
+of sqrt(p * (1 - p) / draws), up to 0.05 for 100 draws, so the differences should shrink as the draws increase.
+
+usage:
+    python benchmarks/confidence_exceedance.py --pixels 2000 --draws 100000
+"""
+import argparse
+import numpy as np
+
+
+def uniform_sum_exceedance(mean, half_width_a, half_width_b, threshold):
+    """NumPy port of `_uniform_sum_exceedance`, NaN inputs are treated as masked
+    """
+    p = np.maximum(np.maximum(half_width_a, half_width_b), 1e-9)
+    q = np.maximum(np.minimum(half_width_a, half_width_b), 1e-9)
+
+    s = threshold - mean
+    s_abs = np.abs(s)
+
+    center = 0.5 - s_abs / (p * 2)
+    tail = (p + q - s_abs) ** 2 / (p * q * 8)
+
+    upper = np.zeros_like(s)
+    upper = np.where(s_abs < p + q, tail, upper)
+    upper = np.where(s_abs < p - q, center, upper)
+    out = np.where(s < 0, 1 - upper, upper)
+
+    masked = np.isnan(mean) | np.isnan(half_width_a) | np.isnan(half_width_b)
+    out[masked] = np.nan
+
+    return out
+
+
+def monte_carlo_confidence(har_pred, lin_pred, har_ci, lin_ci, threshold, n_draws=100, seed=0, batch=1000):
+    """Fraction of simulations above threshold with uniform errors within the 95% confidence intervals,
+    as the removed `calc_confidence` of `export_daily_surface_water` calculated with `n_draws` images
+    """
+    rng = np.random.default_rng(seed)
+    count = np.zeros(har_pred.shape)
+    for start in range(0, n_draws, batch):
+        n = min(batch, n_draws - start)
+        long_term_random = rng.random((n,) + har_pred.shape) * 3.92 - 1.96
+        short_term_random = rng.random((n,) + har_pred.shape) * 3.92 - 1.96
+
+        lin_sim = lin_pred + short_term_random * lin_ci
+        har_sim = har_pred + long_term_random * har_ci
+        count += np.sum(har_sim - lin_sim > threshold, axis=0)
+
+    out = count / n_draws
+    masked = np.isnan(har_pred) | np.isnan(lin_pred) | np.isnan(har_ci) | np.isnan(lin_ci)
+    out[masked] = np.nan
+
+    return out
+
+
+def synthetic_pixels(n_pixels=2000, case="regular", seed=0):
+    """Creates harmonic and residual predictions with their confidence interval half widths (1 sigma)
+    """
+    rng = np.random.default_rng(seed)
+    har_pred = rng.normal(0, 0.2, n_pixels)
+    lin_pred = rng.normal(0, 0.1, n_pixels)
+    har_ci = rng.uniform(0, 0.15, n_pixels)
+    lin_ci = rng.uniform(0, 0.1, n_pixels)
+
+    if case in ("zero_harmonic", "zero_both"):
+        har_ci[:] = 0
+    if case in ("zero_residual", "zero_both"):
+        lin_ci[:] = 0
+    if case == "masked":
+        for arr in (har_pred, lin_pred, har_ci, lin_ci):
+            arr[rng.random(n_pixels) < 0.1] = np.nan
+
+    return har_pred, lin_pred, har_ci, lin_ci
+
+
+def main(n_pixels=2000, n_draws=100000, threshold=0.0, seed=0):
+    cases = ("regular", "zero_harmonic", "zero_residual", "zero_both", "masked")
+
+    print(
+        f"{'case':<15}{'masked':>8}{'mask ok':>9}{'max diff 100':>14}{'max diff ' + str(n_draws):>{11 + len(str(n_draws))}}"
+    )
+    for case in cases:
+        har_pred, lin_pred, har_ci, lin_ci = synthetic_pixels(n_pixels, case, seed)
+
+        analytic = uniform_sum_exceedance(
+            har_pred - lin_pred, har_ci * 1.96, lin_ci * 1.96, threshold
+        )
+        mc_100 = monte_carlo_confidence(
+            har_pred, lin_pred, har_ci, lin_ci, threshold, 100, seed
+        )
+        mc_many = monte_carlo_confidence(
+            har_pred, lin_pred, har_ci, lin_ci, threshold, n_draws, seed
+        )
+
+        masked = np.isnan(mc_100)
+        mask_ok = np.array_equal(np.isnan(analytic), masked)
+        diff_100 = np.nanmax(np.abs(analytic - mc_100))
+        diff_many = np.nanmax(np.abs(analytic - mc_many))
+        print(
+            f"{case:<15}{masked.mean():>8.2f}{str(mask_ok):>9}{diff_100:>14.4f}{diff_many:>{11 + len(str(n_draws))}.4f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pixels", type=int, default=2000)
+    parser.add_argument("--draws", type=int, default=100000)
+    parser.add_argument("--threshold", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.pixels, args.draws, args.threshold, args.seed)
@@ -0,0 +1,60 @@
+"""Benchmark of the numba and NumPy backends of the local kernels.
+Every local function with a compiled kernel is timed with both backends on synthetic SAR scenes with and
+without masked pixels, and the results are checked to be identical. Requires numba to be installed.
+
+usage:
+    python benchmarks/jit_backend.py
+"""
+import time
+import numpy as np
+from hydrafloods import filtering, thresholding, jit
+
+
+def synthetic_scene(shape=(2048, 2048), masked_fraction=0.0, seed=0):
+    """Creates a speckled SAR scene in dB with randomly masked pixels and a HAND array
+    """
+    rng = np.random.default_rng(seed)
+    img = (10 * np.log10(rng.gamma(4, 1 / 4, shape) * 0.05)).astype(np.float32)
+    img[rng.random(shape) < masked_fraction] = np.nan
+    hand = rng.random(shape) * 20
+
+    return img, hand
+
+
+def _time(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+
+def main(masked_fractions=(0.0, 0.02), shape=(2048, 2048)):
+    if not jit.available():
+        raise ImportError("numba needs to be installed to compare the backends")
+
+    print(
+        f"{'function':<22}{'masked':>8}{'numpy [s]':>11}{'numba [s]':>11}{'speedup':>9}{'identical':>11}"
+    )
+    for masked_fraction in masked_fractions:
+        img, hand = synthetic_scene(shape, masked_fraction)
+        cases = (
+            ("lee_sigma_local", filtering.lee_sigma_local, (img,)),
+            ("refined_lee_local", filtering.refined_lee_local, (img,)),
+            ("p_median_local", filtering.p_median_local, (img,)),
+            ("kmeans_extent_local", thresholding.kmeans_extent_local, (img, hand)),
+        )
+        for name, func, args in cases:
+            with jit.use_backend("numba"):
+                # compile the kernels before timing
+                func(*[a[:64, :64] for a in args])
+                t_numba, numba_result = _time(func, *args)
+            with jit.use_backend("numpy"):
+                t_numpy, numpy_result = _time(func, *args)
+
+            identical = np.array_equal(numba_result, numpy_result, equal_nan=True)
+            print(
+                f"{name:<22}{masked_fraction:>8.2f}{t_numpy:>11.3f}{t_numba:>11.3f}{t_numpy / t_numba:>9.1f}{str(identical):>11}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Benchmark of the local speckle filters on synthetic SAR scenes with known ground truth.
+Scenes are made of constant reflectivity blocks with a bright disc so they have straight and curved
+edges, and are multiplied by gamma distributed speckle. Every local filter is timed and the results
+are compared to the truth:
+
+    mpix_per_s        throughput of the best of `repeat` runs
+    peak_memory_mb    peak memory allocated by numpy during one run
+    enl               equivalent number of looks (mean^2 / variance of power) in homogeneous areas
+    enl_improvement   enl of the filtered scene divided by the enl of the speckled scene
+    epi               edge preservation index, correlation of the laplacian of the filtered scene and the truth
+    rmse_db           root mean square error against the truth in dB
+
+usage:
+    python benchmarks/speckle_filters.py --sizes 512 1024 2048 --output speckle_filters.json
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import datetime
+import tracemalloc
+import numpy as np
+import hydrafloods
+from hydrafloods import filtering
+
+FILTERS = {
+    "lee_sigma": (filtering.lee_sigma_local, {"window": 9}),
+    "refined_lee": (filtering.refined_lee_local, {}),
+    "gamma_map": (filtering.gamma_map_local, {"window": 7}),
+    "p_median": (filtering.p_median_local, {"window": 5}),
+}
+
+
+def synthetic_scene(size=1024, looks=4, n_blocks=8, seed=0):
+    """Creates a speckled scene in dB, its ground truth reflectivity in dB and the region labels of the truth
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:size, 0:size]
+
+    cell = -(-size // n_blocks)
+    labels = (rows // cell) * n_blocks + cols // cell
+    disc = (rows - size / 2) ** 2 + (cols - size / 2) ** 2 < (size / 5) ** 2
+    labels[disc] = n_blocks * n_blocks
+
+    levels = 10 ** (rng.uniform(-25, -5, n_blocks * n_blocks + 1) / 10)
+    levels[-1] = 10 ** (2 / 10)
+    truth = levels[labels]
+
+    speckle = rng.gamma(looks, 1 / looks, truth.shape)
+    speckled = (10 * np.log10(truth * speckle)).astype(np.float32)
+
+    return speckled, (10 * np.log10(truth)).astype(np.float32), labels
+
+
+def homogeneous_mask(labels, radius=6):
+    """Finds pixels that have no region boundary within radius so no filter window crosses an edge
+    """
+    edges = np.zeros(labels.shape, dtype=bool)
+    edges[:-1] |= labels[:-1] != labels[1:]
+    edges[1:] |= labels[:-1] != labels[1:]
+    edges[:, :-1] |= labels[:, :-1] != labels[:, 1:]
+    edges[:, 1:] |= labels[:, :-1] != labels[:, 1:]
+
+    w = 2 * radius + 1
+    table = np.zeros((labels.shape[0] + w, labels.shape[1] + w))
+    table[radius + 1 : radius + 1 + labels.shape[0], radius + 1 : radius + 1 + labels.shape[1]] = edges
+    table = table.cumsum(0).cumsum(1)
+    near_edge = table[w:, w:] - table[:-w, w:] - table[w:, :-w] + table[:-w, :-w]
+
+    return near_edge == 0
+
+
+def enl(img_db, labels, homogeneous, min_pixels=100):
+    """Calculates the mean equivalent number of looks of the homogeneous parts of each region,
+    regions with fewer than min_pixels homogeneous pixels are skipped as their estimate is noisy
+    """
+    power = 10 ** (img_db.astype(np.float64) / 10)
+    values = []
+    for label in np.unique(labels[homogeneous]):
+        region = power[(labels == label) & homogeneous]
+        region = region[np.isfinite(region)]
+        if region.size >= min_pixels:
+            values.append(region.mean() ** 2 / region.var())
+
+    return float(np.mean(values))
+
+
+def edge_preservation_index(img_db, truth_db):
+    """Calculates the correlation of the laplacian of an image and the laplacian of the truth
+    """
+
+    def _laplacian(x):
+        return (
+            4 * x[1:-1, 1:-1] - x[:-2, 1:-1] - x[2:, 1:-1] - x[1:-1, :-2] - x[1:-1, 2:]
+        )
+
+    a = _laplacian(truth_db.astype(np.float64))
+    b = _laplacian(img_db.astype(np.float64))
+    valid = np.isfinite(b)
+    a, b = a[valid] - a[valid].mean(), b[valid] - b[valid].mean()
+
+    return float(np.sum(a * b) / np.sqrt(np.sum(a * a) * np.sum(b * b)))
+
+
+def _run(func, img, repeat, **kwargs):
+    """Times the best of repeated runs of a filter and measures the peak memory of one run
+    """
+    # warm up caches such as the sorting networks
+    result = func(img[:64, :64], **kwargs)
+
+    tracemalloc.start()
+    result = func(img, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(img, **kwargs)
+        seconds.append(time.perf_counter() - t0)
+
+    return min(seconds), peak, result
+
+
+def main(sizes=(512, 1024, 2048), filters=None, looks=4, repeat=3, seed=0, output=None):
+    if filters is None:
+        filters = list(FILTERS)
+
+    results = []
+    print(
+        f"{'filter':<13}{'size':>6}{'Mpix/s':>9}{'peak MB':>9}{'ENL':>8}{'ENL x':>7}{'EPI':>7}{'RMSE dB':>9}"
+    )
+    for size in sizes:
+        speckled, truth, labels = synthetic_scene(size, looks=looks, seed=seed)
+        homogeneous = homogeneous_mask(labels)
+        enl_speckled = enl(speckled, labels, homogeneous)
+        epi_speckled = edge_preservation_index(speckled, truth)
+
+        for name in filters:
+            func, kwargs = FILTERS[name]
+            seconds, peak, filtered = _run(func, speckled, repeat, **kwargs)
+            enl_filtered = enl(filtered, labels, homogeneous)
+
+            result = {
+                "filter": name,
+                "params": kwargs,
+                "size": [size, size],
+                "seconds": seconds,
+                "mpix_per_s": size * size / seconds / 1e6,
+                "peak_memory_mb": peak / 1e6,
+                "enl_speckled": enl_speckled,
+                "enl": enl_filtered,
+                "enl_improvement": enl_filtered / enl_speckled,
+                "epi_speckled": epi_speckled,
+                "epi": edge_preservation_index(filtered, truth),
+                "rmse_db": float(np.sqrt(np.nanmean((filtered - truth) ** 2))),
+            }
+            results.append(result)
+            print(
+                f"{name:<13}{size:>6}{result['mpix_per_s']:>9.2f}{result['peak_memory_mb']:>9.1f}{result['enl']:>8.1f}"
+                f"{result['enl_improvement']:>7.1f}{result['epi']:>7.3f}{result['rmse_db']:>9.3f}"
+            )
+
+    report = {
+        "metadata": {
+            "created": datetime.datetime.utcnow().isoformat(),
+            "hydrafloods": hydrafloods.__version__,
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "looks": looks,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--filters", nargs="+", choices=list(FILTERS), default=None)
+    parser.add_argument("--looks", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="path to write JSON results to")
+    args = parser.parse_args()
+
+    main(args.sizes, args.filters, args.looks, args.repeat, args.seed, args.output)
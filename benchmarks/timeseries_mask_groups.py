@@ -0,0 +1,69 @@
+"""Benchmark of the shared-factorization fast path for local time series fits.
+Synthetic stacks are created with spatially correlated cloud masks at varying cloud fractions
+and `fit_harmonic_trend_local` / `fit_linear_trend_local` are timed with and without
+grouping pixels by their valid observation pattern. Results are checked to be equal.
+
+usage:
+    python benchmarks/timeseries_mask_groups.py
+"""
+import time
+import numpy as np
+from hydrafloods import timeseries
+
+
+def synthetic_stack(n_times=120, shape=(512, 512), cloud_fraction=0.3, block=32, seed=0):
+    """Creates a harmonic time series stack with cloud masks that are constant over blocks of pixels
+    """
+    rng = np.random.default_rng(seed)
+    dates = np.datetime64("2015-01-01") + np.sort(
+        rng.choice(365 * 5, n_times, replace=False)
+    ).astype("timedelta64[D]")
+    names, x = timeseries.harmonic_design_matrix(dates)
+
+    n_rows, n_cols = shape
+    coefs = rng.normal(0, 0.2, (len(names), n_rows * n_cols))
+    coefs[1] *= 0.01
+    stack = (x @ coefs + rng.normal(0, 0.05, (n_times, n_rows * n_cols))).reshape(
+        n_times, n_rows, n_cols
+    )
+
+    blocks = rng.random((n_times, -(-n_rows // block), -(-n_cols // block)))
+    clouds = blocks.repeat(block, axis=1).repeat(block, axis=2)[:, :n_rows, :n_cols]
+    mask = clouds >= cloud_fraction
+
+    return dates, stack, mask
+
+
+def _time(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+
+def main(cloud_fractions=(0.0, 0.1, 0.3, 0.5), shape=(512, 512), n_times=120):
+    print(
+        f"{'fit':<10}{'clouds':>8}{'patterns':>10}{'grouped [s]':>13}{'per-pixel [s]':>15}{'speedup':>9}{'max diff':>11}"
+    )
+    for cloud_fraction in cloud_fractions:
+        dates, stack, mask = synthetic_stack(
+            n_times=n_times, shape=shape, cloud_fraction=cloud_fraction
+        )
+        patterns = np.unique(mask.reshape(n_times, -1), axis=1).shape[1]
+        for name, func in (
+            ("harmonic", timeseries.fit_harmonic_trend_local),
+            ("linear", timeseries.fit_linear_trend_local),
+        ):
+            t_group, grouped = _time(
+                func, stack, dates, mask, output_err=True, group_masks=True
+            )
+            t_pixel, pixel = _time(
+                func, stack, dates, mask, output_err=True, group_masks=False
+            )
+            diff = max(np.nanmax(np.abs(grouped[k] - pixel[k])) for k in grouped)
+            print(
+                f"{name:<10}{cloud_fraction:>8.2f}{patterns:>10}{t_group:>13.3f}{t_pixel:>15.3f}{t_pixel / t_group:>9.1f}{diff:>11.2e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
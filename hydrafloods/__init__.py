@@ -2,7 +2,7 @@ from hydrafloods.datasets import *
 from hydrafloods.geeutils import *
 from hydrafloods.thresholding import *
 from hydrafloods.filtering import *
-from hydrafloods import fetch, utils
+from hydrafloods import fetch, utils, cache, cube, jit
 # from hydrafloods import *
 
 __version__ = "0.2.4"
\ No newline at end of file
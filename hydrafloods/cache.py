@@ -0,0 +1,153 @@
+import os
+import ee
+import json
+import sqlite3
+import hashlib
+import datetime
+
+
+class ThresholdCache:
+    """Persistent store of computed thresholds backed by a SQLite database
+
+    Thresholds are keyed by a hash of the source image (asset id or the serialized
+    Earth Engine expression) and all of the algorithm parameters used to calculate the value.
+    Any change in the input imagery or parameters results in a new key, so stored values
+    can be reused for reruns and backfills without issuing the reductions again.
+
+    Example:
+        >>> cache = ThresholdCache("thresholds.db")
+        >>> water = hf.edge_otsu(img, region=region, cache=cache)
+        >>> cache.stats
+        {'hits': 0, 'misses': 1, 'writes': 1, 'entries': 1}
+    """
+
+    def __init__(self, path=None):
+        """Initialize ThresholdCache class
+
+        args:
+            path (str | pathlib.Path | None, optional): file path to SQLite database to store thresholds in.
+                If None then a database at "~/.hydrafloods/threshold_cache.db" will be used. default = None
+        """
+        if path is None:
+            path = os.path.join(
+                os.path.expanduser("~"), ".hydrafloods", "threshold_cache.db"
+            )
+
+        path = str(path)
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS thresholds "
+            "(key TEXT PRIMARY KEY, method TEXT, value REAL, created TEXT)"
+        )
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def __repr__(self):
+        return f"HYDRAFloods ThresholdCache:\n{self.path} {self.stats}"
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM thresholds").fetchone()[0]
+
+    def __contains__(self, key):
+        row = self._conn.execute(
+            "SELECT 1 FROM thresholds WHERE key = ?", (key,)
+        ).fetchone()
+        return row is not None
+
+    @property
+    def stats(self):
+        """Dictionary of cache statistics for the lifetime of the object and number of stored entries
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "entries": len(self),
+        }
+
+    @staticmethod
+    def key(source, method, region=None, **params):
+        """Creates the lookup key for a threshold calculation
+
+        args:
+            source (str | ee.Image): asset id of source image or image object to threshold.
+                Image objects are keyed by a hash of the serialized expression so no request is made
+            method (str): name of thresholding algorithm
+            region (ee.Geometry | None, optional): region used to determine threshold. default = None
+            **params: algorithm parameters used to determine threshold (i.e. `initial_threshold`, `edge_buffer`, `scale`)
+
+        returns:
+            str: hex digest uniquely identifying the source, region, method and parameters
+        """
+        h = hashlib.sha256()
+        h.update(str(method).encode("utf-8"))
+        for obj in (source, region):
+            if isinstance(obj, ee.ComputedObject):
+                obj = obj.serialize()
+            h.update(str(obj).encode("utf-8"))
+        h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+
+        return h.hexdigest()
+
+    def get(self, key):
+        """Gets a stored threshold value, updating the hit/miss statistics
+
+        args:
+            key (str): key of threshold to look up, see `ThresholdCache.key()`
+
+        returns:
+            float | None: stored threshold value, None if key is not in cache
+        """
+        row = self._conn.execute(
+            "SELECT value FROM thresholds WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+        else:
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value, method=None):
+        """Stores a threshold value. Values of None are not stored
+
+        args:
+            key (str): key of threshold to store, see `ThresholdCache.key()`
+            value (float | None): threshold value to store
+            method (str | None, optional): name of thresholding algorithm, stored for reference. default = None
+        """
+        if value is None:
+            return
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO thresholds VALUES (?, ?, ?, ?)",
+            (key, method, float(value), datetime.datetime.utcnow().isoformat()),
+        )
+        self._conn.commit()
+        self.writes += 1
+
+        return
+
+    def clear(self):
+        """Removes all stored thresholds and resets the cache statistics
+        """
+        self._conn.execute("DELETE FROM thresholds")
+        self._conn.commit()
+        self.hits, self.misses, self.writes = 0, 0, 0
+
+        return
+
+    def close(self):
+        """Closes the connection to the SQLite database
+        """
+        self._conn.close()
+
+        return
@@ -0,0 +1,284 @@
+import os
+import json
+import numpy as np
+
+
+class TimeSeriesCube:
+    """Persistent (time, y, x) array store on disk that grows along time without rewriting existing data
+
+    The spatial dimensions are split into chunks and each chunk is stored as one raw binary file with
+    the full time series of the chunk, so new dates are appended to the end of every chunk file and
+    reading the time series of a pixel block only touches that block's file. Chunk files are read
+    as memory-mapped arrays. The dates are stored in an increasing index so date ranges are found with
+    a binary search.
+
+    Layout:
+        path/
+            metadata.json       shape, chunks, dtype and fill value of the cube
+            times.bin           int64 milliseconds since 1970-01-01 of each time step
+            chunk_{i}_{j}.bin   (time, chunk_y, chunk_x) values of spatial chunk i, j
+
+    Example:
+        >>> from hydrafloods import timeseries
+        >>> cube = TimeSeriesCube("water_cube", shape=(2048, 2048), chunks=(512, 512))
+        >>> cube.append("2021-01-01", water_fraction)
+        >>> times, stack = cube.read("2020-01-01", "2021-01-01", window=(slice(0, 256), slice(0, 256)))
+        >>> coefs = cube.apply(timeseries.fit_harmonic_trend_local, "2015-01-01", "2021-01-01")
+    """
+
+    def __init__(self, path, shape=None, chunks=(512, 512), dtype="float32", fill_value=None):
+        """Initialize TimeSeriesCube class, opens an existing cube or creates a new one
+
+        args:
+            path (str | pathlib.Path): directory of the cube
+            shape (tuple[int, int] | None, optional): spatial (y, x) shape of the cube, required when creating a new cube.
+                If the cube exists then the stored shape is used. default = None
+            chunks (tuple[int, int], optional): spatial (y, x) size of chunks. Every append opens one file per chunk so
+                large chunks keep appends of full scenes cheap while small chunks make reads of small windows cheaper. default = (512, 512)
+            dtype (str | numpy.dtype, optional): data type of values. default = "float32"
+            fill_value (float | int | None, optional): value that marks missing data, stored in the metadata and used to
+                pad empty reads. Values are written as is on append so masked pixels need to be set to fill_value before
+                appending. If None then NaN is used for floating point data types and 0 for integer data types. default = None
+
+        raises:
+            ValueError: if the cube does not exist and shape is not provided
+        """
+        self.path = str(path)
+        metadata_path = os.path.join(self.path, "metadata.json")
+
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r") as f:
+                metadata = json.load(f)
+        else:
+            if shape is None:
+                raise ValueError(
+                    f"shape needs to be defined to create a new cube at {self.path}"
+                )
+            if fill_value is None and not np.issubdtype(np.dtype(dtype), np.floating):
+                fill_value = 0
+            metadata = {
+                "shape": [int(s) for s in shape],
+                "chunks": [int(c) for c in chunks],
+                "dtype": np.dtype(dtype).str,
+                "fill_value": fill_value,
+            }
+            os.makedirs(self.path, exist_ok=True)
+            with open(metadata_path, "w") as f:
+                json.dump(metadata, f)
+            open(os.path.join(self.path, "times.bin"), "wb").close()
+
+        self.shape = tuple(metadata["shape"])
+        self.chunks = tuple(metadata["chunks"])
+        self.dtype = np.dtype(metadata["dtype"])
+        self.fill_value = (
+            np.nan if metadata["fill_value"] is None else metadata["fill_value"]
+        )
+
+        self._times = np.fromfile(
+            os.path.join(self.path, "times.bin"), dtype=np.int64
+        )
+
+    def __repr__(self):
+        return (
+            f"HYDRAFloods TimeSeriesCube:\n{self.path} shape={(len(self),) + self.shape} "
+            f"chunks={self.chunks} dtype={self.dtype}"
+        )
+
+    def __len__(self):
+        return self._times.size
+
+    @property
+    def times(self):
+        """Array of numpy.datetime64 dates of each time step
+        """
+        return self._times.astype("datetime64[ms]")
+
+    def append(self, dates, values):
+        """Appends new time steps to the cube. Only the new values are written to the end of each chunk file
+
+        args:
+            dates (str | numpy.datetime64 | list): date or dates of the new time steps. Must be after the last date in the cube
+            values (numpy.ndarray): array of new values with shape (y, x) for a single date or (time, y, x)
+
+        raises:
+            ValueError: if the shape of values does not match the cube or dates are not after the last date in the cube
+        """
+        dates = np.atleast_1d(np.asarray(dates, dtype="datetime64[ms]")).astype(
+            np.int64
+        )
+        values = np.asarray(values, dtype=self.dtype)
+        if values.ndim == 2:
+            values = values[np.newaxis]
+
+        if values.shape != (dates.size,) + self.shape:
+            raise ValueError(
+                f"values expected to have shape {(dates.size,) + self.shape}, got {values.shape}"
+            )
+        last = self._times[-1] if len(self) > 0 else None
+        if np.any(np.diff(dates) <= 0) or (last is not None and dates[0] <= last):
+            raise ValueError(
+                "dates need to be increasing and after the last date in the cube"
+            )
+
+        for (i, j), (rows, cols) in self._chunk_windows():
+            block = np.ascontiguousarray(values[:, rows, cols])
+            with open(self._chunk_path(i, j), "ab") as f:
+                # drop any values left from an append that did not finish
+                f.truncate(len(self) * block[0].nbytes)
+                block.tofile(f)
+
+        # the time index is written last so partially written appends are ignored on read
+        with open(os.path.join(self.path, "times.bin"), "ab") as f:
+            dates.tofile(f)
+        self._times = np.concatenate([self._times, dates])
+
+        return
+
+    def time_slice(self, start=None, end=None):
+        """Finds the time steps between start and end with a binary search of the time index
+
+        args:
+            start (str | numpy.datetime64 | None, optional): date to start on (inclusive). If None then the first date is used. default = None
+            end (str | numpy.datetime64 | None, optional): date to end on (exclusive). If None then the last date is included. default = None
+
+        returns:
+            slice: slice of time steps along the first axis of the cube
+        """
+        lo = (
+            0
+            if start is None
+            else np.searchsorted(
+                self._times, np.datetime64(start, "ms").astype(np.int64), "left"
+            )
+        )
+        hi = (
+            len(self)
+            if end is None
+            else np.searchsorted(
+                self._times, np.datetime64(end, "ms").astype(np.int64), "left"
+            )
+        )
+
+        return slice(int(lo), int(hi))
+
+    def read(self, start=None, end=None, window=None):
+        """Reads values from the cube. Only the chunk files overlapping the window are opened
+
+        args:
+            start (str | numpy.datetime64 | None, optional): date to start on (inclusive). default = None
+            end (str | numpy.datetime64 | None, optional): date to end on (exclusive). default = None
+            window (tuple[slice, slice] | None, optional): spatial (rows, cols) slices to read. If None then the whole
+                spatial extent is read. default = None
+
+        returns:
+            tuple[numpy.ndarray, numpy.ndarray]: dates and values with shape (time, rows, cols)
+        """
+        t = self.time_slice(start, end)
+        if window is None:
+            window = (slice(0, self.shape[0]), slice(0, self.shape[1]))
+        rows, cols = [slice(*w.indices(n)[:2]) for w, n in zip(window, self.shape)]
+
+        out = np.full(
+            (t.stop - t.start, rows.stop - rows.start, cols.stop - cols.start),
+            self.fill_value,
+            dtype=self.dtype,
+        )
+        for (i, j), (chunk_rows, chunk_cols) in self._chunk_windows():
+            r0, r1 = max(rows.start, chunk_rows.start), min(rows.stop, chunk_rows.stop)
+            c0, c1 = max(cols.start, chunk_cols.start), min(cols.stop, chunk_cols.stop)
+            if r0 >= r1 or c0 >= c1:
+                continue
+
+            block = self._open_chunk(i, j)
+            out[:, r0 - rows.start : r1 - rows.start, c0 - cols.start : c1 - cols.start] = block[
+                t,
+                r0 - chunk_rows.start : r1 - chunk_rows.start,
+                c0 - chunk_cols.start : c1 - chunk_cols.start,
+            ]
+
+        return self.times[t], out
+
+    def iter_chunks(self, start=None, end=None):
+        """Generator to read the cube one spatial chunk at a time
+
+        args:
+            start (str | numpy.datetime64 | None, optional): date to start on (inclusive). default = None
+            end (str | numpy.datetime64 | None, optional): date to end on (exclusive). default = None
+
+        yields:
+            tuple[tuple[slice, slice], numpy.ndarray, numpy.ndarray]: spatial window of the chunk, dates and
+                memory-mapped values with shape (time, chunk_y, chunk_x)
+        """
+        t = self.time_slice(start, end)
+        times = self.times[t]
+        for (i, j), window in self._chunk_windows():
+            yield window, times, self._open_chunk(i, j)[t]
+
+    def apply(self, func, start=None, end=None, **kwargs):
+        """Applies a local time series function to the cube chunk by chunk, i.e. `timeseries.fit_harmonic_trend_local`.
+        Only one chunk is read into memory at a time
+
+        args:
+            func (callable): function that takes a (time, y, x) array and the dates as the first two arguments and returns
+                a dictionary of (y, x) arrays or a single array with (y, x) as the last two dimensions
+            start (str | numpy.datetime64 | None, optional): date to start on (inclusive). default = None
+            end (str | numpy.datetime64 | None, optional): date to end on (exclusive). default = None
+            **kwargs: keyword arguments passed to func
+
+        returns:
+            dict[str, numpy.ndarray] | numpy.ndarray: results of func for the full spatial extent
+        """
+        out = None
+        for (rows, cols), times, block in self.iter_chunks(start, end):
+            result = func(block, times, **kwargs)
+
+            if out is None:
+                if isinstance(result, dict):
+                    out = {
+                        k: np.empty(v.shape[:-2] + self.shape, dtype=v.dtype)
+                        for k, v in result.items()
+                    }
+                else:
+                    out = np.empty(result.shape[:-2] + self.shape, dtype=result.dtype)
+
+            if isinstance(result, dict):
+                for k, v in result.items():
+                    out[k][..., rows, cols] = v
+            else:
+                out[..., rows, cols] = result
+
+        return out
+
+    def _chunk_windows(self):
+        """Private helper method to list the index and spatial window of every chunk
+        """
+        windows = []
+        for i, r0 in enumerate(range(0, self.shape[0], self.chunks[0])):
+            for j, c0 in enumerate(range(0, self.shape[1], self.chunks[1])):
+                windows.append(
+                    (
+                        (i, j),
+                        (
+                            slice(r0, min(r0 + self.chunks[0], self.shape[0])),
+                            slice(c0, min(c0 + self.chunks[1], self.shape[1])),
+                        ),
+                    )
+                )
+        return windows
+
+    def _chunk_path(self, i, j):
+        """Private helper method to get the file path of chunk i, j
+        """
+        return os.path.join(self.path, f"chunk_{i}_{j}.bin")
+
+    def _open_chunk(self, i, j):
+        """Private helper method to memory-map chunk i, j with the time steps in the time index
+        """
+        ny = min(self.chunks[0], self.shape[0] - i * self.chunks[0])
+        nx = min(self.chunks[1], self.shape[1] - j * self.chunks[1])
+        if len(self) == 0:
+            return np.empty((0, ny, nx), dtype=self.dtype)
+
+        return np.memmap(
+            self._chunk_path(i, j), dtype=self.dtype, mode="r", shape=(len(self), ny, nx)
+        )
@@ -1,6 +1,49 @@
+import os
 import ee
 import math
-from hydrafloods import geeutils, decorators
+import inspect
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from hydrafloods import geeutils, decorators, jit
+
+# Lee Sigma range and eta values for intensity from table 1 of https://doi.org/10.1109/TGRS.2008.2002881
+# keyed by number of looks then sigma with values of (A1, A2, η)
+SIGMA_LOOKUP = {
+    1: {
+        0.5: (0.436, 1.92, 0.4057),
+        0.6: (0.343, 2.21, 0.4954),
+        0.7: (0.254, 2.582, 0.5911),
+        0.8: (0.168, 3.094, 0.6966),
+        0.9: (0.084, 3.941, 0.8191),
+        0.95: (0.043, 4.840, 0.8599),
+    },
+    2: {
+        0.5: (0.582, 1.584, 0.2763),
+        0.6: (0.501, 1.755, 0.3388),
+        0.7: (0.418, 1.972, 0.4062),
+        0.8: (0.327, 2.260, 0.4819),
+        0.9: (0.221, 2.744, 0.5699),
+        0.95: (0.152, 3.206, 0.6254),
+    },
+    3: {
+        0.5: (0.652, 1.458, 0.2222),
+        0.6: (0.580, 1.586, 0.2736),
+        0.7: (0.505, 1.751, 0.3280),
+        0.8: (0.419, 1.865, 0.3892),
+        0.9: (0.313, 2.320, 0.4624),
+        0.95: (0.238, 2.656, 0.5084),
+    },
+    4: {
+        0.5: (0.694, 1.385, 0.1921),
+        0.6: (0.630, 1.495, 0.2348),
+        0.7: (0.560, 1.627, 0.2825),
+        0.8: (0.480, 1.804, 0.3354),
+        0.9: (0.378, 2.094, 0.3991),
+        0.95: (0.302, 2.360, 0.4391),
+    },
+}
 
 
 @decorators.carry_metadata
@@ -19,72 +62,26 @@ def lee_sigma(img, window=9, sigma=0.9, looks=4, tk=7, keep_bands="angle"):
 
     returns:
         ee.Image: filtered SAR image using the Lee Sigma algorithm
+
+    raises:
+        ValueError: if looks and sigma are not in the lookup table
     """
     band_names = img.bandNames()
     proc_bands = band_names.remove(keep_bands)
     keep_img = img.select(keep_bands)
     img = img.select(proc_bands)
 
-    midPt = (window // 2) + 1 if (window % 2) != 0 else window // 2
-    kernelWeights = ee.List.repeat(ee.List.repeat(1, window), window)
-    kernel = ee.Kernel.fixed(window, window, kernelWeights, midPt, midPt)
-
-    targetWeights = ee.List.repeat(ee.List.repeat(1, 3), 3)
-    targetkernel = ee.Kernel.fixed(3, 3, targetWeights, 1, 1)
-
-    # Lookup table for range and eta values for intensity
-    sigmaLookup = ee.Dictionary(
-        {
-            1: ee.Dictionary(
-                {
-                    0.5: ee.Dictionary({"A1": 0.436, "A2": 1.92, "η": 0.4057}),
-                    0.6: ee.Dictionary({"A1": 0.343, "A2": 2.21, "η": 0.4954}),
-                    0.7: ee.Dictionary({"A1": 0.254, "A2": 2.582, "η": 0.5911}),
-                    0.8: ee.Dictionary({"A1": 0.168, "A2": 3.094, "η": 0.6966}),
-                    0.9: ee.Dictionary({"A1": 0.084, "A2": 3.941, "η": 0.8191}),
-                    0.95: ee.Dictionary({"A1": 0.043, "A2": 4.840, "η": 0.8599}),
-                }
-            ),
-            2: ee.Dictionary(
-                {
-                    0.5: ee.Dictionary({"A1": 0.582, "A2": 1.584, "η": 0.2763}),
-                    0.6: ee.Dictionary({"A1": 0.501, "A2": 1.755, "η": 0.3388}),
-                    0.7: ee.Dictionary({"A1": 0.418, "A2": 1.972, "η": 0.4062}),
-                    0.8: ee.Dictionary({"A1": 0.327, "A2": 2.260, "η": 0.4819}),
-                    0.9: ee.Dictionary({"A1": 0.221, "A2": 2.744, "η": 0.5699}),
-                    0.95: ee.Dictionary({"A1": 0.152, "A2": 3.206, "η": 0.6254}),
-                }
-            ),
-            3: ee.Dictionary(
-                {
-                    0.5: ee.Dictionary({"A1": 0.652, "A2": 1.458, "η": 0.2222}),
-                    0.6: ee.Dictionary({"A1": 0.580, "A2": 1.586, "η": 0.2736}),
-                    0.7: ee.Dictionary({"A1": 0.505, "A2": 1.751, "η": 0.3280}),
-                    0.8: ee.Dictionary({"A1": 0.419, "A2": 1.865, "η": 0.3892}),
-                    0.9: ee.Dictionary({"A1": 0.313, "A2": 2.320, "η": 0.4624}),
-                    0.95: ee.Dictionary({"A1": 0.238, "A2": 2.656, "η": 0.5084}),
-                }
-            ),
-            4: ee.Dictionary(
-                {
-                    0.5: ee.Dictionary({"A1": 0.694, "A2": 1.385, "η": 0.1921}),
-                    0.6: ee.Dictionary({"A1": 0.630, "A2": 1.495, "η": 0.2348}),
-                    0.7: ee.Dictionary({"A1": 0.560, "A2": 1.627, "η": 0.2825}),
-                    0.8: ee.Dictionary({"A1": 0.480, "A2": 1.804, "η": 0.3354}),
-                    0.9: ee.Dictionary({"A1": 0.378, "A2": 2.094, "η": 0.3991}),
-                    0.95: ee.Dictionary({"A1": 0.302, "A2": 2.360, "η": 0.4391}),
-                }
-            ),
-        }
-    )
+    try:
+        a1, a2, eta = SIGMA_LOOKUP[looks][sigma]
+    except KeyError:
+        raise ValueError(
+            f"looks and sigma need to be in the lookup table, got looks={looks} and sigma={sigma}"
+        )
+    eta = eta ** 2
 
-    # extract data from lookup
-    looksDict = ee.Dictionary(sigmaLookup.get(ee.String(str(looks))))
-    sigmaImage = ee.Dictionary(looksDict.get(ee.String(str(sigma)))).toImage()
-    a1 = sigmaImage.select("A1")
-    a2 = sigmaImage.select("A2")
-    aRange = a2.subtract(a1)
-    eta = sigmaImage.select("η").pow(2)
+    midPt = (window // 2) + 1 if (window % 2) != 0 else window // 2
+    kernel = _fixed_kernel(_ones(window, window), midPt, midPt)
+    targetkernel = _fixed_kernel(_ones(3, 3), 1, 1)
 
     img = geeutils.db_to_power(img)
 
@@ -92,9 +89,8 @@ def lee_sigma(img, window=9, sigma=0.9, looks=4, tk=7, keep_bands="angle"):
     mmseMask = img.gte(a1).Or(img.lte(a2))
     mmseIn = img.updateMask(mmseMask)
     oneImg = ee.Image(1)
-    z = mmseIn.reduceNeighborhood(ee.Reducer.mean(), kernel, None, True)
-    varz = mmseIn.reduceNeighborhood(ee.Reducer.variance(), kernel)
-    varx = (varz.subtract(z.abs().pow(2).multiply(eta))).divide(oneImg.add(eta))
+    z, varz = _mean_variance(mmseIn, kernel)
+    varx = (varz.subtract(z.abs().pow(2).multiply(eta))).divide(1 + eta)
     b = varx.divide(varz)
     mmse = oneImg.subtract(b).multiply(z.abs()).add(b.multiply(mmseIn))
 
@@ -138,42 +134,32 @@ def refined_lee(image):
 
         # img must be in natural units, i.e. not in dB!
         # Set up 3x3 kernels
-        weights3 = ee.List.repeat(ee.List.repeat(1, 3), 3)
-        kernel3 = ee.Kernel.fixed(3, 3, weights3, 1, 1, False)
+        kernel3 = _fixed_kernel(_ones(3, 3), 1, 1)
 
-        mean3 = img.reduceNeighborhood(ee.Reducer.mean(), kernel3)
-        variance3 = img.reduceNeighborhood(ee.Reducer.variance(), kernel3)
+        mean3, variance3 = _mean_variance(img, kernel3)
 
         # Use a sample of the 3x3 windows inside a 7x7 windows to determine gradients and directions
-        sample_weights = ee.List(
-            [
-                [0, 0, 0, 0, 0, 0, 0],
-                [0, 1, 0, 1, 0, 1, 0],
-                [0, 0, 0, 0, 0, 0, 0],
-                [0, 1, 0, 1, 0, 1, 0],
-                [0, 0, 0, 0, 0, 0, 0],
-                [0, 1, 0, 1, 0, 1, 0],
-                [0, 0, 0, 0, 0, 0, 0],
-            ]
+        sample_weights = (
+            (0, 0, 0, 0, 0, 0, 0),
+            (0, 1, 0, 1, 0, 1, 0),
+            (0, 0, 0, 0, 0, 0, 0),
+            (0, 1, 0, 1, 0, 1, 0),
+            (0, 0, 0, 0, 0, 0, 0),
+            (0, 1, 0, 1, 0, 1, 0),
+            (0, 0, 0, 0, 0, 0, 0),
         )
 
-        sample_kernel = ee.Kernel.fixed(7, 7, sample_weights, 3, 3, False)
+        sample_kernel = _fixed_kernel(sample_weights, 3, 3)
 
         # Calculate mean and variance for the sampled windows and store as 9 bands
         sample_mean = mean3.neighborhoodToBands(sample_kernel)
         sample_var = variance3.neighborhoodToBands(sample_kernel)
 
-        # Determine the 4 gradients for the sampled windows
-        gradients = sample_mean.select(1).subtract(sample_mean.select(7)).abs()
-        gradients = gradients.addBands(
-            sample_mean.select(6).subtract(sample_mean.select(2)).abs()
-        )
-        gradients = gradients.addBands(
-            sample_mean.select(3).subtract(sample_mean.select(5)).abs()
-        )
-        gradients = gradients.addBands(
-            sample_mean.select(0).subtract(sample_mean.select(8)).abs()
-        )
+        # Determine the 4 gradients for the sampled windows, each from a pair of opposite windows
+        first = sample_mean.select([1, 6, 3, 0])
+        second = sample_mean.select([7, 2, 5, 8])
+        center = sample_mean.select(4)
+        gradients = first.subtract(second).abs()
 
         # And find the maximum gradient amongst gradient bands
         max_gradient = gradients.reduce(ee.Reducer.max())
@@ -184,36 +170,11 @@ def refined_lee(image):
         # duplicate gradmask bands: each gradient represents 2 directions
         gradmask = gradmask.addBands(gradmask)
 
-        # Determine the 8 directions
-        directions = (
-            sample_mean.select(1)
-            .subtract(sample_mean.select(4))
-            .gt(sample_mean.select(4).subtract(sample_mean.select(7)))
-            .multiply(1)
+        # Determine the 8 directions, the next 4 are the not() of the first 4
+        greater = first.subtract(center).gt(center.subtract(second))
+        directions = greater.multiply(ee.Image.constant([1, 2, 3, 4])).addBands(
+            greater.Not().multiply(ee.Image.constant([5, 6, 7, 8]))
         )
-        directions = directions.addBands(
-            sample_mean.select(6)
-            .subtract(sample_mean.select(4))
-            .gt(sample_mean.select(4).subtract(sample_mean.select(2)))
-            .multiply(2)
-        )
-        directions = directions.addBands(
-            sample_mean.select(3)
-            .subtract(sample_mean.select(4))
-            .gt(sample_mean.select(4).subtract(sample_mean.select(5)))
-            .multiply(3)
-        )
-        directions = directions.addBands(
-            sample_mean.select(0)
-            .subtract(sample_mean.select(4))
-            .gt(sample_mean.select(4).subtract(sample_mean.select(8)))
-            .multiply(4)
-        )
-        # The next 4 are the not() of the previous 4
-        directions = directions.addBands(directions.select(0).Not().multiply(5))
-        directions = directions.addBands(directions.select(1).Not().multiply(6))
-        directions = directions.addBands(directions.select(2).Not().multiply(7))
-        directions = directions.addBands(directions.select(3).Not().multiply(8))
 
         # Mask all values that are not 1-8
         directions = directions.updateMask(gradmask)
@@ -232,70 +193,25 @@ def refined_lee(image):
         )
 
         # Set up the 7*7 kernels for directional statistics
-        rect_weights = ee.List.repeat(ee.List.repeat(0, 7), 3).cat(
-            ee.List.repeat(ee.List.repeat(1, 7), 4)
-        )
+        rect_weights = ((0,) * 7,) * 3 + ((1,) * 7,) * 4
 
-        diag_weights = ee.List(
-            [
-                [1, 0, 0, 0, 0, 0, 0],
-                [1, 1, 0, 0, 0, 0, 0],
-                [1, 1, 1, 0, 0, 0, 0],
-                [1, 1, 1, 1, 0, 0, 0],
-                [1, 1, 1, 1, 1, 0, 0],
-                [1, 1, 1, 1, 1, 1, 0],
-                [1, 1, 1, 1, 1, 1, 1],
-            ]
+        diag_weights = tuple(
+            tuple(1 if j <= i else 0 for j in range(7)) for i in range(7)
         )
 
-        rect_kernel = ee.Kernel.fixed(7, 7, rect_weights, 3, 3, False)
-        diag_kernel = ee.Kernel.fixed(7, 7, diag_weights, 3, 3, False)
-
         # Create stacks for mean and variance using the original kernels. Mask with relevant direction.
-        dir_mean = img.reduceNeighborhood(ee.Reducer.mean(), rect_kernel).updateMask(
-            directions.eq(1)
-        )
-        dir_var = img.reduceNeighborhood(ee.Reducer.variance(), rect_kernel).updateMask(
-            directions.eq(1)
-        )
-
-        dir_mean = dir_mean.addBands(
-            img.reduceNeighborhood(ee.Reducer.mean(), diag_kernel).updateMask(
-                directions.eq(2)
-            )
-        )
-        dir_var = dir_var.addBands(
-            img.reduceNeighborhood(ee.Reducer.variance(), diag_kernel).updateMask(
-                directions.eq(2)
-            )
-        )
-
-        # and add the bands for rotated kernels
-        for i in range(1, 4):
-            dir_mean = dir_mean.addBands(
-                img.reduceNeighborhood(
-                    ee.Reducer.mean(), rect_kernel.rotate(i)
-                ).updateMask(directions.eq(2 * i + 1))
-            )
-            dir_var = dir_var.addBands(
-                img.reduceNeighborhood(
-                    ee.Reducer.variance(), rect_kernel.rotate(i)
-                ).updateMask(directions.eq(2 * i + 1))
-            )
-            dir_mean = dir_mean.addBands(
-                img.reduceNeighborhood(
-                    ee.Reducer.mean(), diag_kernel.rotate(i)
-                ).updateMask(directions.eq(2 * i + 2))
-            )
-            dir_var = dir_var.addBands(
-                img.reduceNeighborhood(
-                    ee.Reducer.variance(), diag_kernel.rotate(i)
-                ).updateMask(directions.eq(2 * i + 2))
-            )
-
-        # "collapse" the stack into a single band image (due to masking, each pixel has just one value in it's directional band, and is otherwise masked)
-        dir_mean = dir_mean.reduce(ee.Reducer.sum())
-        dir_var = dir_var.reduce(ee.Reducer.sum())
+        dir_stats = []
+        for i in range(4):
+            for j, weights in enumerate((rect_weights, diag_weights)):
+                stats = img.reduceNeighborhood(
+                    _mean_variance_reducer(), _rotated_kernel(weights, i)
+                )
+                dir_stats.append(stats.updateMask(directions.eq(2 * i + j + 1)))
+
+        # "collapse" the stack into a single image (due to masking, each pixel has just one value in it's directional image, and is otherwise masked)
+        dir_stats = ee.ImageCollection(dir_stats).sum()
+        dir_mean = dir_stats.select(0)
+        dir_var = dir_stats.select(1)
 
         # A finally generate the filtered value
         varX = dir_var.subtract(dir_mean.multiply(dir_mean).multiply(sigmaV)).divide(
@@ -337,18 +253,16 @@ def gamma_map(img, window=7, enl=4.9):
 
     bandNames = img.bandNames()
     # Square kernel, window should be odd (typically 3, 5 or 7)
-    weights = ee.List.repeat(ee.List.repeat(1, window), window)
     midPt = (window // 2) + 1 if (window % 2) != 0 else window // 2
 
     # ~~(window/2) does integer division in JavaScript
-    kernel = ee.Kernel.fixed(window, window, weights, midPt, midPt, False)
+    kernel = _fixed_kernel(_ones(window, window), midPt, midPt)
 
     # Convert image from dB to natural values
     nat_img = geeutils.db_to_power(img)
 
     # Get mean and variance
-    mean = nat_img.reduceNeighborhood(ee.Reducer.mean(), kernel)
-    variance = nat_img.reduceNeighborhood(ee.Reducer.variance(), kernel)
+    mean, variance = _mean_variance(nat_img, kernel)
 
     # "Pure speckle" threshold
     ci = variance.sqrt().divide(mean)  # square root of inverse of enl
@@ -369,16 +283,13 @@ def gamma_map(img, window=7, enl=4.9):
     )
     f = b.multiply(mean).add(d.sqrt()).divide(alpha.multiply(2.0))
 
-    caster = ee.Dictionary.fromLists(bandNames, ee.List.repeat("float", 3))
-    img1 = (
-        geeutils.power_to_db(mean.updateMask(ci.lte(cu))).rename(bandNames).cast(caster)
-    )
+    img1 = geeutils.power_to_db(mean.updateMask(ci.lte(cu))).rename(bandNames).float()
     img2 = (
         geeutils.power_to_db(f.updateMask(ci.gt(cu)).updateMask(ci.lt(cmax)))
         .rename(bandNames)
-        .cast(caster)
+        .float()
     )
-    img3 = img.updateMask(ci.gte(cmax)).rename(bandNames).cast(caster)
+    img3 = img.updateMask(ci.gte(cmax)).rename(bandNames).float()
 
     # If ci > cmax do not filter at all (i.e. we don't do anything, other then masking)
     result = (
@@ -410,22 +321,20 @@ def p_median(img, window=5):
 
     center_idx = (window - 1) // 2
 
-    hv = [
-        [1 if i == center_idx or j == center_idx else 0 for j in range(window)]
+    hv = tuple(
+        tuple(1 if i == center_idx or j == center_idx else 0 for j in range(window))
         for i in range(window)
-    ]
-    diag = [
-        [1 if i == j or i == ((window - 1) - j) else 0 for j in range(window)]
+    )
+    diag = tuple(
+        tuple(1 if i == j or i == ((window - 1) - j) else 0 for j in range(window))
         for i in range(window)
-    ]
+    )
 
     # method based on ???
     band_names = img.bandNames()
-    hv_weights = ee.List(hv)
-    diag_weights = ee.List(diag)
 
-    hv_kernel = ee.Kernel.fixed(window, window, hv_weights)
-    diag_kernel = ee.Kernel.fixed(window, window, diag_weights)
+    hv_kernel = _fixed_kernel(hv)
+    diag_kernel = _fixed_kernel(diag)
 
     hv_median = img.reduceNeighborhood(ee.Reducer.median(), hv_kernel)
 
@@ -433,3 +342,1045 @@ def p_median(img, window=5):
 
     return ee.Image.cat([hv_median, diag_median]).reduce("mean").rename(band_names)
 
+
+def multitemporal_filter(collection, window=7, keep_bands="angle"):
+    """Multitemporal speckle filtering algorithm for a stack of SAR images.
+    Each image is filtered as its moving window mean multiplied by the temporal mean of the ratios
+    between every image in the stack and its own moving window mean, see https://doi.org/10.1109/36.843012
+
+    args:
+        collection (ee.ImageCollection | hydrafloods.Dataset): collection of SAR images in dB from the same orbit to filter
+        window (int, optional): moving window size to calculate spatial means (i.e. a value of 7 == 7x7 window), should be odd. default = 7
+        keep_bands (str | list[str], optional): band name or list of band names to drop during filtering and include in the result
+            default = "angle"
+
+    returns:
+        ee.ImageCollection | hydrafloods.Dataset: filtered SAR images, returns the same type as collection
+
+    raises:
+        ValueError: if collection is not of type ee.ImageCollection or hydrafloods.Dataset
+    """
+    dataset = None
+    if not isinstance(collection, ee.ImageCollection):
+        try:
+            dataset, collection = collection, collection.collection
+        except AttributeError:
+            raise ValueError(
+                "collection argument expected type ee.ImageCollection or hydrafloods.Dataset, "
+                + f"got {type(collection)}"
+            )
+
+    keep_bands = ee.List([keep_bands]).flatten()
+    proc_bands = ee.Image(collection.first()).bandNames().removeAll(keep_bands)
+    kernel = _fixed_kernel(_ones(window, window))
+
+    def _spatial_mean(img):
+        """Closure function to calculate the moving window mean of an image in power
+        """
+        power = geeutils.db_to_power(img.select(proc_bands))
+        return power, power.reduceNeighborhood(ee.Reducer.mean(), kernel)
+
+    def _ratio(img):
+        """Closure function to calculate the ratio of an image and its moving window mean
+        """
+        power, mean = _spatial_mean(img)
+        return power.divide(mean)
+
+    @decorators.carry_metadata
+    def _filter(img):
+        """Closure function to apply the multitemporal filter on an image
+        """
+        _, mean = _spatial_mean(img)
+        filtered = geeutils.power_to_db(mean.multiply(ratio_mean)).rename(proc_bands)
+        return filtered.addBands(img.select(keep_bands))
+
+    # masked dates are skipped in the temporal mean
+    ratio_mean = collection.map(_ratio).mean()
+    filtered = collection.map(_filter)
+
+    if dataset is None:
+        return filtered
+    else:
+        out = dataset.copy()
+        out.collection = filtered
+        return out
+
+
+def _ones(height, width):
+    """Private helper function to create kernel weights of ones as nested tuples
+    """
+    return ((1,) * width,) * height
+
+
+@functools.lru_cache(maxsize=None)
+def _fixed_kernel(weights, x=None, y=None):
+    """Private helper function to create an unnormalized ee.Kernel from nested tuples of weights.
+    The weights are sent as a literal in the request instead of being built server-side and kernels are
+    cached so filters applied to many bands or images reuse the same kernel object
+    """
+    return ee.Kernel.fixed(
+        len(weights[0]), len(weights), [list(row) for row in weights], x, y
+    )
+
+
+def _mean_variance_reducer():
+    """Private helper function to create a combined mean and variance reducer
+    """
+    return ee.Reducer.mean().combine(ee.Reducer.variance(), None, True)
+
+
+def _mean_variance(img, kernel):
+    """Private helper function to calculate the moving window mean and variance of an image with one
+    neighborhood reduction sharing the kernel. Returns the mean and variance images
+    """
+    stats = img.reduceNeighborhood(_mean_variance_reducer(), kernel)
+
+    return stats.select(".*_mean$"), stats.select(".*_variance$")
+
+
+def _rotated_kernel(weights, rotations):
+    """Private helper function to create a 7x7 kernel from weights rotated clockwise by 90 degrees
+    `rotations` times, the same as ee.Kernel.rotate
+    """
+    kernel = _fixed_kernel(weights, 3, 3)
+    return kernel.rotate(rotations) if rotations else kernel
+
+
+def lee_sigma_local(
+    img, window=9, sigma=0.9, looks=4, tk=7, z99=None, tile_size=512, n_workers=None
+):
+    """Lee Sigma speckle filtering algorithm for local arrays, see `lee_sigma()`.
+    Window means and variances are calculated from summed-area tables so the cost per pixel does not depend
+    on the window size and the sigma lookup values are resolved from `SIGMA_LOOKUP` before filtering.
+    Square tiles with a halo of window // 2 pixels are filtered in parallel threads
+
+    args:
+        img (numpy.ndarray): SAR backscatter in dB with shape (y, x) or (band, y, x). NaN values are treated as masked
+        window (int, optional): moving window size to apply filter (i.e. a value of 9 == 9x9 window), should be odd. default = 9
+        sigma (float, optional): sigma lookup value from table 1 in paper. default = 0.9
+        looks (int, optional): look intensity value from table 1 in paper. default = 4
+        tk (int, optional): threshold value to determine values in window as point targets. default = 7
+        z99 (float | None, optional): 99th percentile of power values used to find point targets. If None then it is
+            calculated from each band of img, set this when filtering tiles of a larger scene. default = None
+        tile_size (int, optional): (y, x) size of the square tiles to filter excluding the halo. default = 512
+        n_workers (int | None, optional): number of threads to filter tiles with. If None then the number of CPUs is used. default = None
+
+    returns:
+        numpy.ndarray: filtered SAR backscatter in dB with the same shape as img
+
+    raises:
+        ValueError: if looks and sigma are not in the lookup table
+    """
+    try:
+        a1, a2, eta = SIGMA_LOOKUP[looks][sigma]
+    except KeyError:
+        raise ValueError(
+            f"looks and sigma need to be in the lookup table, got looks={looks} and sigma={sigma}"
+        )
+
+    def _filter(tile):
+        """Closure function to apply the Lee Sigma filter on a tile of power values
+        """
+        valid = np.isfinite(tile)
+        mmse_valid = valid & ((tile >= a1) | (tile <= a2))
+        mmse_in = np.where(mmse_valid, tile, 0)
+
+        n = _box_count(mmse_valid, window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = _box_sum(mmse_in, window) / n
+            varz = np.maximum(_box_sum(mmse_in * mmse_in, window) / n - z * z, 0)
+            varx = (varz - z * z * eta ** 2) / (1 + eta ** 2)
+            b = np.where(varz > 0, varx / varz, 0)
+        mmse = (1 - b) * np.abs(z) + b * tile
+
+        # keep point targets where most of the 3x3 neighborhood is above the 99th percentile
+        if jit.enabled():
+            out = _point_target_kernel(tile, mmse, threshold, tk)
+        else:
+            k = _box_sum(tile >= threshold, 3)
+            out = np.where(k >= tk, tile, mmse)
+        out[~mmse_valid] = np.nan
+
+        return out
+
+    power = _db_to_power_local(img)
+
+    out = np.empty(power.shape, dtype=np.float32)
+    for band in np.ndindex(power.shape[:-2]):
+        if z99 is None:
+            # percentile from up to ~1e6 pixels as the ee implementation uses
+            stride = max(1, int(math.sqrt(power[band].size / 1e6)))
+            threshold = np.nanpercentile(power[band][::stride, ::stride], 99)
+        else:
+            threshold = z99
+        out[band] = _map_tiles(
+            _filter, power[band], max(window // 2, 1), tile_size, n_workers
+        )
+
+    return _power_to_db_local(out)
+
+
+def _db_to_power_local(img):
+    """Private helper function to convert local dB arrays to power as float32
+    """
+    return np.power(np.float32(10), np.asarray(img, dtype=np.float32) / np.float32(10))
+
+
+def _power_to_db_local(img):
+    """Private helper function to convert local power arrays to dB in place
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.log10(img, out=img)
+    img *= 10
+    return img
+
+
+def _box_sum(img, window):
+    """Private helper function to calculate the sum of values within a square moving window over the
+    last two axes using a summed-area table. Pixels outside of the array do not contribute to the sum
+    """
+    r = window // 2
+    w = 2 * r + 1
+    padded = np.zeros(img.shape[:-2] + (img.shape[-2] + w, img.shape[-1] + w))
+    padded[..., r + 1 : r + 1 + img.shape[-2], r + 1 : r + 1 + img.shape[-1]] = img
+    np.cumsum(padded, axis=-2, out=padded)
+    np.cumsum(padded, axis=-1, out=padded)
+
+    return (
+        padded[..., w:, w:]
+        - padded[..., :-w, w:]
+        - padded[..., w:, :-w]
+        + padded[..., :-w, :-w]
+    )
+
+
+def _box_count(valid, window):
+    """Private helper function to count the valid pixels within a square moving window over the last two axes.
+    Uses the separable count of pixels inside the array when all pixels are valid
+    """
+    if valid.all():
+        r = window // 2
+        rows, cols = [
+            np.minimum(np.arange(n) + r + 1, n) - np.maximum(np.arange(n) - r, 0)
+            for n in valid.shape[-2:]
+        ]
+        return np.broadcast_to(np.outer(rows, cols).astype(np.float64), valid.shape)
+
+    return _box_sum(valid, window)
+
+
+def _map_tiles(func, img, halo, tile_size=512, n_workers=None, out=None):
+    """Private helper function to apply a neighborhood function over square tiles of a (..., y, x) array.
+    Each tile is read with `halo` extra pixels on every side so the results have no seams. Tiles are processed
+    in parallel threads, numpy releases the GIL for the heavy array operations. Tiling both axes keeps the
+    intermediate arrays of each thread bounded by the tile size instead of the image width.
+    Tiles are written into `out` when provided, it must not overlap img as the halos are read from img
+    """
+    if out is None:
+        out = np.empty(img.shape, dtype=np.float32)
+
+    def _run(tile):
+        read, write, trim = tile
+        out[(Ellipsis,) + write] = func(img[(Ellipsis,) + read])[(Ellipsis,) + trim]
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    tiles = _tile_windows(img.shape[-2:], (tile_size, tile_size), halo)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(_run, tiles))
+
+    return out
+
+
+def _tile_windows(shape, tile_size, halo):
+    """Private helper function to split a (y, x) extent into tiles. Returns a list of the (rows, cols) slices
+    to read each tile with `halo` extra pixels on every side clipped to the extent, the slices to write the
+    tile to and the slices to trim the halo from the filtered tile
+    """
+    tiles = []
+    for r0 in range(0, shape[0], tile_size[0]):
+        for c0 in range(0, shape[1], tile_size[1]):
+            r1, c1 = min(r0 + tile_size[0], shape[0]), min(c0 + tile_size[1], shape[1])
+            h0, h1 = max(r0 - halo, 0), min(r1 + halo, shape[0])
+            w0, w1 = max(c0 - halo, 0), min(c1 + halo, shape[1])
+            tiles.append(
+                (
+                    (slice(h0, h1), slice(w0, w1)),
+                    (slice(r0, r1), slice(c0, c1)),
+                    (slice(r0 - h0, r1 - h0), slice(c0 - w0, c1 - w0)),
+                )
+            )
+
+    return tiles
+
+
+def apply_tiled(
+    func, img, halo, tile_size=1024, n_workers=None, out_path=None, **kwargs
+):
+    """Applies a local neighborhood function, i.e. `gamma_map_local`, over a large array in halo padded tiles
+    on a pool of processes. The input is placed in shared memory once so tiles are not copied to the workers and
+    each worker writes its tile trimmed of the halo directly into the output, so only a few tiles are in memory
+    at a time besides the input and output. When halo is at least the radius of the function's neighborhood the
+    result has no seams and matches filtering the whole array at once, up to the rounding of summed-area tables.
+    Functions that use statistics of the whole array should have them passed in, i.e. `z99` of `lee_sigma_local`
+
+    args:
+        func (callable): function that takes an array with shape (..., y, x) and returns a filtered array of the same shape.
+            Must be importable at the module level so it can be sent to the worker processes
+        img (numpy.ndarray): array to filter with shape (y, x) or (band, y, x)
+        halo (int): number of extra pixels to read on each side of a tile, i.e. window // 2 for `gamma_map_local`
+            and `p_median_local` or 3 for `refined_lee_local`
+        tile_size (int | tuple[int, int], optional): (y, x) size of tiles to filter excluding the halo. default = 1024
+        n_workers (int | None, optional): number of processes to filter tiles with. If None then the number of CPUs is used. default = None
+        out_path (str | pathlib.Path | None, optional): .npy file to write the result to as a memory-mapped array so that
+            the result does not have to fit into memory. If None then the result is returned as an in-memory array. default = None
+        **kwargs: keyword arguments passed to func. If func has a `n_workers` argument it is set to 1 unless provided
+
+    returns:
+        numpy.ndarray | numpy.memmap: float32 filtered array with the same shape as img, memory-mapped if out_path is given
+
+    raises:
+        ImportError: if the Python version is older than 3.8 and does not have `multiprocessing.shared_memory`
+    """
+    # shared_memory was added in python 3.8, imported here so the module still imports on older versions
+    from multiprocessing import shared_memory
+
+    if isinstance(tile_size, int):
+        tile_size = (tile_size, tile_size)
+    if "n_workers" in inspect.signature(func).parameters:
+        kwargs.setdefault("n_workers", 1)
+
+    img = np.asarray(img)
+    tiles = _tile_windows(img.shape[-2:], tile_size, halo)
+
+    src = shared_memory.SharedMemory(create=True, size=max(img.nbytes, 1))
+    dst = None
+    try:
+        np.ndarray(img.shape, dtype=img.dtype, buffer=src.buf)[...] = img
+        src_spec = (src.name, img.shape, img.dtype.str)
+
+        if out_path is None:
+            nbytes = max(int(np.prod(img.shape)) * np.dtype(np.float32).itemsize, 1)
+            dst = shared_memory.SharedMemory(create=True, size=nbytes)
+            out_spec = ("shm", dst.name, img.shape)
+        else:
+            out_path = str(out_path)
+            np.lib.format.open_memmap(
+                out_path, mode="w+", dtype=np.float32, shape=img.shape
+            ).flush()
+            out_spec = ("npy", out_path, img.shape)
+
+        task = functools.partial(_apply_tile, func, src_spec, out_spec, kwargs)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(task, tiles))
+
+        if out_path is None:
+            out = np.ndarray(img.shape, dtype=np.float32, buffer=dst.buf).copy()
+        else:
+            out = np.load(out_path, mmap_mode="r+")
+
+    finally:
+        src.close()
+        src.unlink()
+        if dst is not None:
+            dst.close()
+            dst.unlink()
+
+    return out
+
+
+def _apply_tile(func, src_spec, out_spec, kwargs, tile):
+    """Private helper function to filter one tile in a worker process of `apply_tiled()`.
+    Attaches to the shared input, filters the halo padded tile and writes the trimmed result to the output
+    """
+    from multiprocessing import shared_memory
+
+    read, write, trim = tile
+    name, shape, dtype = src_spec
+    src = shared_memory.SharedMemory(name=name)
+    img = np.ndarray(shape, dtype=dtype, buffer=src.buf)
+    tile_in = np.array(img[(Ellipsis,) + read])
+    # views of the buffer need to be released before the shared memory is closed
+    del img
+    src.close()
+
+    result = func(tile_in, **kwargs)
+
+    kind, target, shape = out_spec
+    if kind == "shm":
+        dst = shared_memory.SharedMemory(name=target)
+        out = np.ndarray(shape, dtype=np.float32, buffer=dst.buf)
+        out[(Ellipsis,) + write] = result[(Ellipsis,) + trim]
+        del out
+        dst.close()
+    else:
+        out = np.load(target, mmap_mode="r+")
+        out[(Ellipsis,) + write] = result[(Ellipsis,) + trim]
+        out.flush()
+
+    return
+
+
+def refined_lee_local(img, tile_size=512, n_workers=None):
+    """Refined Lee speckle filtering algorithm for local arrays, see `refined_lee()`.
+    The 3x3 means and variances are calculated once with summed-area tables, the nine sampled windows are
+    strided views of them and each pixel's direction is picked with argmax. The 7x7 directional statistics are
+    gathered only for the selected direction of each pixel instead of calculated for all eight kernels.
+    All bands (i.e. VV and VH) are filtered together in one pass
+
+    args:
+        img (numpy.ndarray): SAR backscatter in dB with shape (y, x) or (band, y, x). NaN values are treated as masked
+        tile_size (int, optional): (y, x) size of the square tiles to filter excluding the halo. default = 512
+        n_workers (int | None, optional): number of threads to filter tiles with. If None then the number of CPUs is used. default = None
+
+    returns:
+        numpy.ndarray: filtered SAR backscatter in dB with the same shape as img
+    """
+    power = _db_to_power_local(img)
+    squeeze = power.ndim == 2
+    if squeeze:
+        power = power[np.newaxis]
+
+    out = _map_tiles(_refined_lee_tile, power, 3, tile_size, n_workers)
+    out = _power_to_db_local(out)
+
+    return out[0] if squeeze else out
+
+
+def _refined_lee_kernels():
+    """Private helper function to get the (row, column) offsets of the eight 7x7 directional kernels
+    ordered as the directions in `refined_lee()`, i.e. rectangle and diagonal kernels rotated clockwise 0-3 times
+    """
+    rect = [(dy, dx) for dy in range(0, 4) for dx in range(-3, 4)]
+    diag = [(dy, dx) for dy in range(-3, 4) for dx in range(-3, 4) if dx <= dy]
+
+    kernels = []
+    for i in range(4):
+        for kernel in (rect, diag):
+            for _ in range(i):
+                kernel = [(dx, -dy) for dy, dx in kernel]
+            kernels.append(kernel)
+
+    return np.array(kernels)
+
+
+_REFINED_LEE_KERNELS = _refined_lee_kernels()
+
+
+def _refined_lee_tile(tile):
+    """Private helper function to apply the Refined Lee filter on a (band, y, x) tile of power values
+    """
+    n_bands, h, w = tile.shape
+    valid = np.isfinite(tile)
+    values = np.where(valid, tile, 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n3 = _box_count(valid, 3)
+        mean3 = _box_sum(values, 3) / n3
+        var3 = np.maximum(_box_sum(values * values, 3) / n3 - mean3 * mean3, 0)
+    mean3, var3 = mean3.astype(np.float32), var3.astype(np.float32)
+
+    # nine sampled 3x3 windows within the 7x7 window as strided views
+    pad = ((0, 0), (2, 2), (2, 2))
+    mean_padded = np.pad(mean3, pad, mode="edge")
+    var_padded = np.pad(var3, pad, mode="edge")
+    offsets = [(dy, dx) for dy in (-2, 0, 2) for dx in (-2, 0, 2)]
+    sample_mean = [mean_padded[:, 2 + dy : 2 + dy + h, 2 + dx : 2 + dx + w] for dy, dx in offsets]
+    sample_var = [var_padded[:, 2 + dy : 2 + dy + h, 2 + dx : 2 + dx + w] for dy, dx in offsets]
+
+    # local noise variance from the five most homogeneous sampled windows
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats = [v / (m * m) for m, v in zip(sample_mean, sample_var)]
+    # masked windows sort last
+    stats = [np.where(np.isnan(stat), np.inf, stat) for stat in stats]
+    _sort_arrays(stats)
+    sigma_v = sum(stats[:5]) / 5
+
+    padded = np.pad(tile, ((0, 0), (3, 3), (3, 3)), constant_values=np.nan)
+    if jit.enabled():
+        total, total_sq, count = _refined_lee_kernel(
+            padded, mean_padded, _REFINED_LEE_KERNELS
+        )
+    else:
+        # gradient with the largest change and which side of it the center is on
+        pairs = [(1, 7), (6, 2), (3, 5), (0, 8)]
+        gradients = np.stack([np.abs(sample_mean[a] - sample_mean[b]) for a, b in pairs])
+        gradient = np.argmax(gradients, axis=0)[np.newaxis]
+        center = sample_mean[4]
+        sides = np.stack(
+            [(sample_mean[a] - center) > (center - sample_mean[b]) for a, b in pairs]
+        )
+        direction = np.where(
+            np.take_along_axis(sides, gradient, 0)[0], gradient[0], gradient[0] + 4
+        )
+
+        # gather the directional kernel values of the selected direction only
+        hp, wp = padded.shape[1:]
+        flat = padded.ravel()
+        b, y, x = np.indices((n_bands, h, w), sparse=True)
+        base = b * (hp * wp) + (y + 3) * wp + (x + 3)
+        kernel_offsets = _REFINED_LEE_KERNELS[..., 0] * wp + _REFINED_LEE_KERNELS[..., 1]
+
+        total = np.zeros((n_bands, h, w))
+        total_sq = np.zeros((n_bands, h, w))
+        count = np.zeros((n_bands, h, w))
+        for k in range(kernel_offsets.shape[1]):
+            v = flat[base + kernel_offsets[direction, k]]
+            finite = np.isfinite(v)
+            v = np.where(finite, v, 0)
+            total += v
+            total_sq += v * v
+            count += finite
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dir_mean = total / count
+        dir_var = total_sq / count - dir_mean * dir_mean
+        var_x = (dir_var - dir_mean * dir_mean * sigma_v) / (sigma_v + 1)
+        weight = np.where(dir_var > 0, var_x / dir_var, 0)
+
+    out = dir_mean + weight * (tile - dir_mean)
+    out[~valid] = np.nan
+
+    return out
+
+
+def gamma_map_local(img, window=7, enl=4.9, tile_size=512, n_workers=None):
+    """Gamma Map speckle filtering algorithm for local arrays, see `gamma_map()`.
+    The window mean and variance are calculated together from integral images of x and x^2 and
+    the three regimes are evaluated with one `np.select`
+
+    args:
+        img (numpy.ndarray): SAR backscatter in dB with shape (y, x) or (band, y, x). NaN values are treated as masked
+        window (int, optional): moving window size to apply filter (i.e. a value of 7 == 7x7 window), should be odd. default = 7
+        enl (float, optional): equivalent number of looks (enl) per pixel from a SAR scan. default = 4.9
+        tile_size (int, optional): (y, x) size of the square tiles to filter excluding the halo. default = 512
+        n_workers (int | None, optional): number of threads to filter tiles with. If None then the number of CPUs is used. default = None
+
+    returns:
+        numpy.ndarray: filtered SAR backscatter in dB with the same shape as img
+    """
+    cu = 1.0 / math.sqrt(enl)
+    cmax = math.sqrt(2.0) * cu
+
+    def _filter(tile):
+        """Closure function to apply the Gamma Map filter on a tile of power values
+        """
+        valid = np.isfinite(tile)
+        values = np.where(valid, tile, 0)
+
+        n = _box_count(valid, window)
+        sums = _box_sum(np.stack([values, values * values]), window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = sums[0] / n
+            variance = np.maximum(sums[1] / n - mean * mean, 0)
+            ci = np.sqrt(variance) / mean
+
+            alpha = (1.0 + cu * cu) / (ci * ci - cu * cu)
+            b = alpha - (enl + 1.0)
+            d = mean * mean * b * b + alpha * mean * tile * (4.0 * enl)
+            f = (b * mean + np.sqrt(d)) / (alpha * 2.0)
+
+        # pure speckle -> mean, low texture -> filtered value, high texture -> unfiltered
+        out = np.select([ci <= cu, ci < cmax], [mean, f], default=tile)
+        out[~valid | np.isnan(ci)] = np.nan
+
+        return out
+
+    power = _db_to_power_local(img)
+
+    out = np.empty(power.shape, dtype=np.float32)
+    for band in np.ndindex(power.shape[:-2]):
+        _map_tiles(
+            _filter, power[band], window // 2, tile_size, n_workers, out=out[band]
+        )
+
+    return _power_to_db_local(out)
+
+
+def p_median_local(img, window=5, tile_size=512, n_workers=None):
+    """P-Median filter for local arrays, see `p_median()`.
+    The 2*window-1 samples of the cross and diagonal kernels are strided views from `sliding_window_view`
+    and the medians are found with a sorting network pruned to the middle positions.
+    Masked pixels are skipped within the kernels and remain masked in the result
+
+    args:
+        img (numpy.ndarray): array to filter with shape (y, x) or (band, y, x). NaN values are treated as masked
+        window (int, optional): moving window size to apply filter (i.e. a value of 5 == 5x5 window), 3 to 11. default = 5
+        tile_size (int, optional): (y, x) size of the square tiles to filter excluding the halo. default = 512
+        n_workers (int | None, optional): number of threads to filter tiles with. If None then the number of CPUs is used. default = None
+
+    returns:
+        numpy.ndarray: filtered array with the same shape as img
+
+    raises:
+        ValueError: if window is not between 3 and 11
+    """
+    if window % 2 == 0:
+        window += 1
+    if not 3 <= window <= 11:
+        raise ValueError(f"window needs to be between 3 and 11, got {window}")
+
+    r = window // 2
+
+    def _kernel_median(view):
+        """Closure function to calculate the mean of the cross and diagonal kernel medians from a window view
+        """
+        hv = [view[..., r, j] for j in range(window)] + [
+            view[..., i, r] for i in range(window) if i != r
+        ]
+        diag = [view[..., i, i] for i in range(window)] + [
+            view[..., i, window - 1 - i] for i in range(window) if i != r
+        ]
+
+        hv_median = _median_arrays(hv)
+        diag_median = _median_arrays(diag)
+
+        return np.where(
+            np.isnan(hv_median),
+            diag_median,
+            np.where(np.isnan(diag_median), hv_median, (hv_median + diag_median) / 2),
+        )
+
+    def _filter(tile):
+        """Closure function to apply the P-Median filter on a tile
+        """
+        pad = [(0, 0)] * (tile.ndim - 2) + [(r, r), (r, r)]
+        padded = np.pad(tile, pad, constant_values=np.nan)
+        masked = np.isnan(tile).any()
+        # the sorting network is faster than the compiled kernel when there are no masked values to skip
+        if jit.enabled() and masked:
+            out = _p_median_kernel(padded.reshape((-1,) + padded.shape[-2:]), window)
+            return out.reshape(tile.shape)
+
+        view = sliding_window_view(padded, (window, window), axis=(-2, -1))
+        ny, nx = tile.shape[-2:]
+
+        if ny <= 2 * r or nx <= 2 * r or masked:
+            out = _kernel_median(view)
+        else:
+            # only the border pixels see the padding so the interior takes the all-valid path
+            out = np.empty(tile.shape, dtype=tile.dtype)
+            out[..., r:-r, r:-r] = _kernel_median(view[..., r:-r, r:-r, :, :])
+            out[..., :r, :] = _kernel_median(view[..., :r, :, :, :])
+            out[..., -r:, :] = _kernel_median(view[..., -r:, :, :, :])
+            out[..., r:-r, :r] = _kernel_median(view[..., r:-r, :r, :, :])
+            out[..., r:-r, -r:] = _kernel_median(view[..., r:-r, -r:, :, :])
+
+        out[np.isnan(tile)] = np.nan
+
+        return out
+
+    img = np.asarray(img, dtype=np.float32)
+
+    return _map_tiles(_filter, img, r, tile_size, n_workers)
+
+
+def _median_arrays(values):
+    """Private helper function to calculate the elementwise median of a list of arrays skipping NaN values.
+    NaN values are replaced with -inf or inf so that the median of the valid values falls at the middle positions
+    for every element, then the list is sorted with a pruned sorting network
+    """
+    n = len(values)
+    k = (n - 1) // 2
+    valid = [~np.isnan(v) for v in values]
+
+    if all(v.all() for v in valid) and n % 2 == 1:
+        return _sort_arrays(list(values), outputs=(k,))[k]
+
+    count = sum(v.astype(np.int16) for v in valid)
+    n_low = k - (np.maximum(count, 1) - 1) // 2
+
+    padded = []
+    rank = np.zeros(count.shape, dtype=np.int16)
+    for v, ok in zip(values, valid):
+        rank += ~ok
+        padded.append(np.where(ok, v, np.where(rank <= n_low, -np.inf, np.inf)))
+
+    upper = min(k + 1, n - 1)
+    padded = _sort_arrays(padded, outputs=(k, upper))
+    with np.errstate(invalid="ignore"):
+        median = (padded[k] + np.where(count % 2 == 0, padded[upper], padded[k])) / 2
+
+    return np.where(count > 0, median, np.nan)
+
+
+@functools.lru_cache(maxsize=None)
+def _sorting_network(n, outputs=None):
+    """Private helper function to get the comparators of Batcher's odd-even merge sorting network for n values.
+    The network for the next power of two is used with comparators for positions beyond n dropped.
+    If outputs is given then only the comparators that the sorted values at those positions depend on are kept
+    """
+    size = 1
+    while size < n:
+        size *= 2
+
+    comparators = []
+    p = 1
+    while p < size:
+        k = p
+        while k >= 1:
+            for j in range(k % p, size - k, 2 * k):
+                for i in range(min(k, size - j - k)):
+                    a, b = i + j, i + j + k
+                    if a // (2 * p) == b // (2 * p) and b < n:
+                        comparators.append((a, b))
+            k //= 2
+        p *= 2
+
+    if outputs is not None:
+        needed = set(outputs)
+        pruned = []
+        for a, b in reversed(comparators):
+            if a in needed or b in needed:
+                pruned.append((a, b))
+                needed.update((a, b))
+        comparators = pruned[::-1]
+
+    return tuple(comparators)
+
+
+def _sort_arrays(values, outputs=None):
+    """Private helper function to sort a list of equally shaped arrays elementwise with a sorting network,
+    the list items are replaced so after sorting values[0] is the elementwise minimum. If outputs is given
+    then only the values at those positions are guaranteed to be in sorted order. NaN values are not supported
+    """
+    for a, b in _sorting_network(len(values), outputs):
+        values[a], values[b] = (
+            np.minimum(values[a], values[b]),
+            np.maximum(values[a], values[b]),
+        )
+
+    return values
+
+
+def multitemporal_filter_local(stack, window=7, tile_size=512, n_workers=None):
+    """Multitemporal speckle filtering algorithm for local stacks, see `multitemporal_filter()`.
+    The stack is read one image at a time in two passes: the first accumulates running sums of the
+    ratios of each image to its moving window mean and the second yields the filtered images, so memory
+    does not depend on the length of the stack and memory-mapped stacks are never fully loaded
+
+    args:
+        stack (numpy.ndarray | list[numpy.ndarray]): SAR backscatter in dB with shape (time, y, x) or (time, band, y, x),
+            any sequence of images that can be iterated twice such as a memory-mapped array. NaN values are treated as masked
+        window (int, optional): moving window size to calculate spatial means (i.e. a value of 7 == 7x7 window), should be odd. default = 7
+        tile_size (int, optional): (y, x) size of the square tiles to filter excluding the halo. default = 512
+        n_workers (int | None, optional): number of threads to filter tiles with. If None then the number of CPUs is used. default = None
+
+    returns:
+        generator: filtered SAR backscatter in dB as a numpy.ndarray for each image in the stack
+
+    raises:
+        ValueError: if stack is an iterator that can only be iterated once, i.e. a generator
+    """
+    if iter(stack) is stack:
+        raise ValueError(
+            "stack needs to be iterated twice, got a one-shot iterator. Use a list or array of images instead"
+        )
+
+    return _multitemporal_filter_images(stack, window, tile_size, n_workers)
+
+
+def _multitemporal_filter_images(stack, window, tile_size, n_workers):
+    """Private helper generator of `multitemporal_filter_local()` that reads the stack in two passes
+    and yields the filtered images
+    """
+
+    def _mean(tile):
+        """Closure function to calculate the moving window mean of a tile of power values
+        """
+        valid = np.isfinite(tile)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return _box_sum(np.where(valid, tile, 0), window) / _box_count(
+                valid, window
+            )
+
+    def _spatial_mean(img):
+        """Closure function to convert an image to power and calculate its moving window mean
+        """
+        power = _db_to_power_local(img)
+        mean = np.empty(power.shape, dtype=np.float32)
+        for band in np.ndindex(power.shape[:-2]):
+            mean[band] = _map_tiles(
+                _mean, power[band], window // 2, tile_size, n_workers
+            )
+        return power, mean
+
+    ratio_sum, count = None, None
+    for img in stack:
+        power, mean = _spatial_mean(img)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = power / mean
+        valid = np.isfinite(ratio)
+
+        if ratio_sum is None:
+            ratio_sum = np.zeros(ratio.shape, dtype=np.float64)
+            count = np.zeros(ratio.shape, dtype=np.int32)
+        ratio_sum += np.where(valid, ratio, 0)
+        count += valid
+
+    if ratio_sum is None:
+        return
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio_mean = (ratio_sum / count).astype(np.float32)
+
+    for img in stack:
+        power, mean = _spatial_mean(img)
+        out = mean * ratio_mean
+        out[np.isnan(power)] = np.nan
+
+        yield _power_to_db_local(out)
+
+
+def sar_preprocess_local(
+    vv,
+    vh,
+    angle,
+    orbit=None,
+    speckle_filter=None,
+    halo=0,
+    units="db",
+    min_angle=30,
+    max_angle=45,
+    dtype="float32",
+    scale=100,
+    tile_size=512,
+    n_workers=None,
+    out=None,
+    **kwargs,
+):
+    """Fused Sentinel 1 preprocessing for local arrays. Applies the incidence angle mask of `Sentinel1.qa()`,
+    an optional speckle filter, unit conversion and the ratio and NDPI bands of `Sentinel1.add_fusion_features()`
+    in one pass per tile of rows. Each tile is written to the output as soon as it is processed so there are no
+    intermediate full scene arrays and the output can be a memory-mapped array
+
+    args:
+        vv (numpy.ndarray): VV backscatter in dB with shape (y, x), can be a memory-mapped array
+        vh (numpy.ndarray): VH backscatter in dB with shape (y, x), can be a memory-mapped array
+        angle (numpy.ndarray): incidence angle in degrees with shape (y, x), can be a memory-mapped array
+        orbit (str | None, optional): orbit pass of the image, "ASCENDING" or "DESCENDING". If provided an "orbit" band is
+            added with 1 for ascending and 0 for descending as `Sentinel1.add_fusion_features()` does. default = None
+        speckle_filter (callable | None, optional): local speckle filter applied to the (2, y, x) VV and VH dB values
+            of each tile, i.e. `gamma_map_local`. If None then no filtering is applied. default = None
+        halo (int, optional): number of extra rows read on each side of a tile for the speckle filter, should be the radius
+            of the filter's neighborhood so there are no seams, i.e. window // 2 for `gamma_map_local`. default = 0
+        units (str, optional): units of the output VV and VH bands, the ratio and NDPI are calculated from these values.
+            options are "db" or "power". default = "db"
+        min_angle (float, optional): incidence angle in degrees that values need to be greater than. default = 30
+        max_angle (float, optional): incidence angle in degrees that values need to be less than. default = 45
+        dtype (str, optional): data type of the output, options are "float32" with NaN as masked or "int16" where values
+            are multiplied by scale and rounded with -32768 as masked. default = "float32"
+        scale (float | list[float], optional): scale factor for int16 output, a single value or one value per band. default = 100
+        tile_size (int, optional): number of rows to process in each tile. default = 512
+        n_workers (int | None, optional): number of threads to process tiles with. If None then the number of CPUs is used. default = None
+        out (numpy.ndarray | None, optional): array with shape (band, y, x) and data type dtype to write results to, i.e. a
+            memory-mapped array. If None then a new array is created. default = None
+        **kwargs: keyword arguments passed to speckle_filter. If it has a `n_workers` argument it is set to 1 unless provided
+
+    returns:
+        numpy.ndarray: preprocessed image with bands "VV", "VH", "ratio", "ndpi" and "orbit" (if orbit is provided)
+
+    raises:
+        ValueError: if units or dtype are not one of the available options or out does not have the expected shape and type
+    """
+    if units not in ("db", "power"):
+        raise ValueError(f"units needs to be either 'db' or 'power', got {units}")
+    if dtype not in ("float32", "int16"):
+        raise ValueError(f"dtype needs to be either 'float32' or 'int16', got {dtype}")
+
+    n_bands = 4 if orbit is None else 5
+    shape = np.shape(vv)
+    if out is None:
+        out = np.empty((n_bands,) + shape, dtype=dtype)
+    elif out.shape != (n_bands,) + shape or out.dtype != np.dtype(dtype):
+        raise ValueError(
+            f"out expected to have shape {(n_bands,) + shape} and dtype {dtype}, got {out.shape} and {out.dtype}"
+        )
+
+    scales = np.broadcast_to(np.asarray(scale, dtype=np.float32), (n_bands,))
+    scales = scales.reshape(n_bands, 1, 1)
+    if speckle_filter is not None and "n_workers" in inspect.signature(
+        speckle_filter
+    ).parameters:
+        kwargs.setdefault("n_workers", 1)
+
+    def _run(tile):
+        """Closure function to preprocess a tile and write it to the output
+        """
+        read, write, trim = tile
+        a = np.asarray(angle[read], dtype=np.float32)
+        masked = ~((a > min_angle) & (a < max_angle))
+
+        bands = np.empty((n_bands,) + a.shape, dtype=np.float32)
+        bands[0] = vv[read]
+        bands[1] = vh[read]
+        sar = bands[:2]
+        sar[:, masked] = np.nan
+
+        if speckle_filter is not None:
+            sar[...] = speckle_filter(sar, **kwargs)
+        if units == "power":
+            np.power(np.float32(10), sar / np.float32(10), out=sar)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.divide(bands[0], bands[1], out=bands[2])
+            np.divide(bands[0] - bands[1], bands[0] + bands[1], out=bands[3])
+        if orbit is not None:
+            bands[4] = 0 if orbit == "DESCENDING" else 1
+
+        result = bands[(slice(None),) + trim]
+        if dtype == "int16":
+            nodata = np.isnan(result)
+            result = np.rint(result * scales)
+            np.clip(result, -32767, 32767, out=result)
+            result[nodata] = -32768
+        out[(slice(None),) + write] = result
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    tiles = _tile_windows(shape, (tile_size, shape[1]), halo)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(_run, tiles))
+
+    return out
+
+
+@jit.njit
+def _point_target_kernel(tile, mmse, threshold, tk):
+    """Private helper function to select the Lee Sigma point targets of a (y, x) tile in compiled loops.
+    Keeps the tile value where at least tk pixels of the 3x3 neighborhood are above threshold, else the MMSE value
+    """
+    h, w = tile.shape
+    out = np.empty((h, w), dtype=np.float64)
+    for y in range(h):
+        for x in range(w):
+            k = 0
+            for yy in range(max(y - 1, 0), min(y + 2, h)):
+                for xx in range(max(x - 1, 0), min(x + 2, w)):
+                    if tile[yy, xx] >= threshold:
+                        k += 1
+            out[y, x] = tile[y, x] if k >= tk else mmse[y, x]
+
+    return out
+
+
+@jit.njit
+def _refined_lee_kernel(padded, mean_padded, kernels):
+    """Private helper function to select the Refined Lee direction of each pixel and sum the values within
+    the directional kernel in compiled loops. Takes the (band, y, x) tile padded by 3 with NaN and the 3x3 means
+    padded by 2 with edge values, returns the sum, sum of squares and count of valid values in the kernel
+    """
+    n_bands, hp, wp = padded.shape
+    h, w = hp - 6, wp - 6
+    total = np.zeros((n_bands, h, w))
+    total_sq = np.zeros((n_bands, h, w))
+    count = np.zeros((n_bands, h, w))
+
+    # sampled window index pairs of the four gradients, windows are ordered row-wise with a spacing of 2
+    first = (1, 6, 3, 0)
+    second = (7, 2, 5, 8)
+    sample = np.empty(9, dtype=mean_padded.dtype)
+    for b in range(n_bands):
+        for y in range(h):
+            for x in range(w):
+                for i in range(9):
+                    sample[i] = mean_padded[b, y + 2 * (i // 3), x + 2 * (i % 3)]
+                center = sample[4]
+
+                # first maximum gradient, or first NaN gradient as np.argmax
+                gradient = 0
+                largest = np.abs(sample[first[0]] - sample[second[0]])
+                if not np.isnan(largest):
+                    for g in range(1, 4):
+                        value = np.abs(sample[first[g]] - sample[second[g]])
+                        if np.isnan(value):
+                            gradient = g
+                            break
+                        if value > largest:
+                            gradient, largest = g, value
+
+                direction = gradient
+                if not (sample[first[gradient]] - center) > (
+                    center - sample[second[gradient]]
+                ):
+                    direction += 4
+
+                for k in range(kernels.shape[1]):
+                    v = padded[b, y + 3 + kernels[direction, k, 0], x + 3 + kernels[direction, k, 1]]
+                    if np.isfinite(v):
+                        total[b, y, x] += v
+                        total_sq[b, y, x] += v * v
+                        count[b, y, x] += 1
+
+    return total, total_sq, count
+
+
+@jit.njit
+def _insert_sorted(values, n, value):
+    """Private helper function to insert a value into the first n sorted values of an array, NaN values are skipped.
+    Returns the new number of values
+    """
+    if np.isnan(value):
+        return n
+    i = n
+    while i > 0 and values[i - 1] > value:
+        values[i] = values[i - 1]
+        i -= 1
+    values[i] = value
+
+    return n + 1
+
+
+@jit.njit
+def _sorted_median(values, n):
+    """Private helper function to get the median of the first n sorted values of an array as float64
+    """
+    if n == 0:
+        return np.nan
+    if n % 2 == 1:
+        return np.float64(values[n // 2])
+
+    return (np.float64(values[n // 2 - 1]) + np.float64(values[n // 2])) / 2
+
+
+@jit.njit
+def _p_median_kernel(padded, window):
+    """Private helper function to calculate the P-Median filter of a (band, y, x) tile padded with NaN
+    in compiled loops. Medians of the valid cross and diagonal kernel values are found with insertion sorts
+    """
+    r = window // 2
+    n_bands, hp, wp = padded.shape
+    h, w = hp - 2 * r, wp - 2 * r
+    out = np.empty((n_bands, h, w), dtype=np.float32)
+    hv = np.empty(2 * window - 1, dtype=padded.dtype)
+    diag = np.empty(2 * window - 1, dtype=padded.dtype)
+
+    for b in range(n_bands):
+        for y in range(h):
+            for x in range(w):
+                if np.isnan(padded[b, y + r, x + r]):
+                    out[b, y, x] = np.nan
+                    continue
+
+                n_hv, n_diag = 0, 0
+                for i in range(window):
+                    n_hv = _insert_sorted(hv, n_hv, padded[b, y + r, x + i])
+                    n_diag = _insert_sorted(diag, n_diag, padded[b, y + i, x + i])
+                    if i != r:
+                        n_hv = _insert_sorted(hv, n_hv, padded[b, y + i, x + r])
+                        n_diag = _insert_sorted(
+                            diag, n_diag, padded[b, y + i, x + window - 1 - i]
+                        )
+
+                hv_median = _sorted_median(hv, n_hv)
+                diag_median = _sorted_median(diag, n_diag)
+                if np.isnan(hv_median):
+                    out[b, y, x] = diag_median
+                elif np.isnan(diag_median):
+                    out[b, y, x] = hv_median
+                else:
+                    out[b, y, x] = (hv_median + diag_median) / 2
+
+    return out
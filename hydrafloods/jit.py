@@ -0,0 +1,116 @@
+import os
+import warnings
+import contextlib
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ("auto", "numba", "numpy")
+
+_backend = "auto"
+
+
+def available():
+    """Checks if the optional numba package is installed to JIT compile local kernels
+
+    returns:
+        bool: True if numba can be imported
+    """
+    return numba is not None
+
+
+def set_backend(backend="auto"):
+    """Sets the backend used for the loop heavy local kernels, i.e. `filtering.p_median_local`.
+    Both backends return identical results. The backend can also be set with the
+    HYDRAFLOODS_BACKEND environment variable before hydrafloods is imported, invalid values
+    fall back to "auto" with a warning
+
+    args:
+        backend (str, optional): backend to use, options are "auto", "numba" or "numpy".
+            "auto" uses numba when it is installed and NumPy otherwise. default = "auto"
+
+    raises:
+        ValueError: if backend is not one of the available options
+        ImportError: if backend is "numba" and numba is not installed
+    """
+    global _backend
+
+    if backend not in BACKENDS:
+        raise ValueError(f"backend needs to be one of {BACKENDS}, got {backend}")
+    if backend == "numba" and not available():
+        raise ImportError(
+            "numba needs to be installed to use the numba backend, i.e. `pip install numba`"
+        )
+
+    _backend = backend
+
+    return
+
+
+def get_backend():
+    """Gets the backend that local kernels are currently using
+
+    returns:
+        str: "numba" or "numpy"
+    """
+    if _backend == "auto":
+        return "numba" if available() else "numpy"
+    return _backend
+
+
+def enabled():
+    """Checks if local kernels use the JIT compiled implementations
+
+    returns:
+        bool: True if the current backend is numba
+    """
+    return get_backend() == "numba"
+
+
+@contextlib.contextmanager
+def use_backend(backend):
+    """Context manager to temporarily set the backend of local kernels, see `set_backend()`
+
+    args:
+        backend (str): backend to use, options are "auto", "numba" or "numpy"
+
+    example:
+        >>> with hf.jit.use_backend("numpy"):
+        ...     filtered = hf.filtering.p_median_local(img)
+    """
+    previous = _backend
+    set_backend(backend)
+    try:
+        yield
+    finally:
+        set_backend(previous)
+
+
+def njit(func):
+    """Decorator to JIT compile a kernel with numba when it is installed. Kernels are compiled on
+    the first call, release the GIL so tiles can run in parallel threads and are cached on disk.
+    Without numba the plain Python function is returned and callers should use their NumPy path
+    """
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+def _backend_from_env():
+    """Private helper function to set the backend from the HYDRAFLOODS_BACKEND environment variable.
+    Invalid values or "numba" without numba installed fall back to "auto" with a warning so that
+    the optional backend cannot break importing hydrafloods
+    """
+    backend = os.environ.get("HYDRAFLOODS_BACKEND", "auto")
+    try:
+        set_backend(backend)
+    except (ValueError, ImportError) as e:
+        warnings.warn(f"ignoring HYDRAFLOODS_BACKEND, using the 'auto' backend: {e}")
+        set_backend("auto")
+
+    return
+
+
+_backend_from_env()
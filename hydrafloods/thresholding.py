@@ -1,7 +1,8 @@
 import ee
 from ee.ee_exception import EEException
 import random
-from hydrafloods import geeutils, decorators
+import numpy as np
+from hydrafloods import geeutils, decorators, jit
 
 
 @decorators.carry_metadata
@@ -20,6 +21,7 @@ def bmax_otsu(
     min_bucket_width=0.001,
     max_raw=1e6,
     return_threshold=False,
+    cache=None,
 ):
     """Implementation of the B-Max Otsu thresholding algorithm.
     Detailed explanation of algorithm can be found at https://doi.org/10.3390/rs12152469
@@ -39,58 +41,16 @@ def bmax_otsu(
         min_bucket_width (float, optional): The minimum histogram bucket width to allow any power of 2. default = 0.001
         max_raw (int, optional): The number of values to accumulate before building the initial histogram. default = 1e6
         return_threshold (bool, optional): boolean switch, if set to true then function will return threshold number, else thresholded image. default = False
+        cache (hydrafloods.cache.ThresholdCache | None, optional): client-side threshold store to consult before issuing reductions. If the threshold
+            is not stored then it will be calculated with a blocking request and saved to the cache, so it cannot be used within
+            mapped functions such as `ee.ImageCollection.map()`. default = None
 
     returns:
         ee.Image: thresholded image based (if return_threshold==False) or threshold value (if return_threshold==True) based on the threshold determined by the algorithm
-    """
 
-    def calcBmax(feature):
-        """Closure function to calculate Bmax for each feature covering image
-        """
-        segment = img 
-        initial = segment.lt(initial_threshold)
-        p1 = ee.Number(
-            initial.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=feature.geometry(),
-                bestEffort=True,
-                scale=scale,
-            ).get(histBand)
-        )
-        p1 = ee.Number(ee.Algorithms.If(p1, p1, 0.99))
-        p2 = ee.Number(1).subtract(p1)
-
-        m = (
-            segment.updateMask(initial)
-            .rename("m1")
-            .addBands(segment.updateMask(initial.Not()).rename("m2"))
-        )
-
-        mReduced = m.reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=feature.geometry(),
-            bestEffort=True,
-            scale=scale,
-        )
-
-        m1 = ee.Number(mReduced.get("m1"))
-        m2 = ee.Number(mReduced.get("m2"))
-
-        m1 = ee.Number(ee.Algorithms.If(m1, m1, -25))
-        m2 = ee.Number(ee.Algorithms.If(m2, m2, 0))
-
-        sigmab = p1.multiply(p2.multiply(m1.subtract(m2).pow(2)))
-        sigmat = ee.Number(
-            segment.reduceRegion(
-                reducer=ee.Reducer.variance(),
-                geometry=feature.geometry(),
-                bestEffort=True,
-                scale=scale,
-            ).get(histBand)
-        )
-        sigmat = ee.Number(ee.Algorithms.If(sigmat, sigmat, 2))
-        bmax = sigmab.divide(sigmat)
-        return feature.set({"bmax": bmax})
+    raises:
+        ValueError: if cache is provided within a mapped function
+    """
 
     if band is None:
         img = img.select([0])
@@ -103,30 +63,22 @@ def bmax_otsu(
     if region is None:
         region = img.geometry()
 
-    grid = geeutils.tile_region(region, intersect_geom=region, grid_size=0.1)
-
-    bmaxes = (
-        grid.map(calcBmax)
-        .filter(ee.Filter.gt("bmax", bmax_threshold))
-        .randomColumn("random", seed)
+    params = dict(
+        scale=scale,
+        initial_threshold=initial_threshold,
+        grid_size=grid_size,
+        bmax_threshold=bmax_threshold,
+        max_boxes=max_boxes,
+        seed=seed,
+        max_buckets=max_buckets,
+        min_bucket_width=min_bucket_width,
+        max_raw=max_raw,
     )
 
-    nBoxes = ee.Number(bmaxes.size())
-    randomThresh = ee.Number(max_boxes).divide(nBoxes)
-    selection = bmaxes.filter(ee.Filter.lt("random", randomThresh))
-
-    histogram = img.reduceRegion(
-        ee.Reducer.histogram(max_buckets, min_bucket_width, max_raw)
-        .combine("mean", None, True)
-        .combine("variance", None, True),
-        selection,
-        scale,
-        bestEffort=True,
-        tileScale=16,
+    threshold = _cached_otsu(
+        img, histBand, region, "bmax_otsu", _bmax_histogram, params, cache
     )
 
-    threshold = otsu(histogram.get(histBand.cat("_histogram")))
-
     if return_threshold is True:
         return ee.Image(threshold)
     else:
@@ -152,6 +104,7 @@ def edge_otsu(
     min_bucket_width=0.001,
     max_raw=1e6,
     return_threshold=False,
+    cache=None,
 ):
     """Implementation of the Edge Otsu thresholding algorithm.
     Detailed explanation of algorithm can be found at https://doi.org/10.3390/rs12152469
@@ -173,9 +126,15 @@ def edge_otsu(
         min_bucket_width (float, optional): The minimum histogram bucket width to allow any power of 2. default = 0.001
         max_raw (int, optional): The number of values to accumulate before building the initial histogram. default = 1e6
         return_threshold (bool, optional): boolean switch, if set to true then function will return threshold number, else thresholded image. default = False
+        cache (hydrafloods.cache.ThresholdCache | None, optional): client-side threshold store to consult before issuing reductions. If the threshold
+            is not stored then it will be calculated with a blocking request and saved to the cache, so it cannot be used within
+            mapped functions such as `ee.ImageCollection.map()`. default = None
 
     returns:
         ee.Image: thresholded image based (if return_threshold==False) or threshold value (if return_threshold==True) based on the threshold determined by the algorithm
+
+    raises:
+        ValueError: if cache is provided within a mapped function
     """
 
     if band is None:
@@ -189,32 +148,24 @@ def edge_otsu(
     if region is None:
         region = img.geometry()
 
-    binary = img.lt(initial_threshold).rename("binary")
-
-    # get canny edges
-    canny = ee.Algorithms.CannyEdgeDetector(binary, canny_threshold, canny_sigma)
-    # process canny edges
-    connected = (
-        canny.mask(canny).lt(canny_lt).connectedPixelCount(connected_pixels, True)
+    params = dict(
+        scale=scale,
+        initial_threshold=initial_threshold,
+        canny_threshold=canny_threshold,
+        canny_sigma=canny_sigma,
+        canny_lt=canny_lt,
+        connected_pixels=connected_pixels,
+        edge_length=edge_length,
+        edge_buffer=edge_buffer,
+        max_buckets=max_buckets,
+        min_bucket_width=min_bucket_width,
+        max_raw=max_raw,
     )
-    edges = connected.gte(edge_length)
-    edgeBuffer = edges.focal_max(edge_buffer, "square", "meters")
 
-    # mask out areas to get histogram for Otsu
-    histogram_image = img.updateMask(edgeBuffer)
-
-    histogram = histogram_image.reduceRegion(
-        ee.Reducer.histogram(max_buckets, min_bucket_width, max_raw)
-        .combine("mean", None, True)
-        .combine("variance", None, True),
-        region,
-        scale,
-        bestEffort=True,
-        tileScale=16,
+    threshold = _cached_otsu(
+        img, histBand, region, "edge_otsu", _edge_histogram, params, cache
     )
 
-    threshold = otsu(histogram.get(histBand.cat("_histogram")))
-
     if return_threshold is True:
         return threshold
     else:
@@ -262,6 +213,78 @@ def otsu(histogram):
     return ee.Number(output)
 
 
+def multi_otsu(histogram, n_classes=3):
+    """Multi-level Otsu's method thresholding algorithm.
+    Computes the `n_classes - 1` intensity thresholds that maximize the between-class variance of a histogram.
+    Uses prefix sums and a dynamic programming search so the cost is O(n_classes * buckets**2) rather than
+    searching all combinations of buckets. Calculation is performed client-side.
+
+    args:
+        histogram (dict | ee.Dictionary): computed object from ee.Reducer.histogram with keys "histogram" and "bucketMeans".
+            If an ee.Dictionary is provided then it will be requested with `getInfo()`
+        n_classes (int, optional): number of classes to separate histogram into. default = 3
+
+    returns:
+        list[float]: sorted threshold values, thresholds are the mean of the highest bucket in the lower class as in `otsu`
+
+    raises:
+        ValueError: if n_classes is less than 2 or the histogram has fewer non-empty buckets than n_classes
+
+    Example:
+        ```python
+        vv = img.select("VV")
+        hist = vv.reduceRegion(ee.Reducer.histogram(1024), region, 90).get("VV")
+        thresholds = hf.multi_otsu(hist, n_classes=3)
+        classes = vv.gt(ee.Image.constant(thresholds)).reduce("sum")
+        ```
+    """
+    if isinstance(histogram, ee.ComputedObject):
+        histogram = ee.Dictionary(histogram).getInfo()
+
+    counts = np.asarray(histogram["histogram"], dtype=np.float64)
+    means = np.asarray(histogram["bucketMeans"], dtype=np.float64)
+
+    # drop empty buckets, they do not change class statistics
+    keep = counts > 0
+    counts, means = counts[keep], means[keep]
+    n = counts.size
+
+    if n_classes < 2:
+        raise ValueError(f"n_classes expected to be 2 or greater, got {n_classes}")
+    if n < n_classes:
+        raise ValueError(
+            f"histogram has {n} non-empty buckets, need at least n_classes={n_classes}"
+        )
+
+    # prefix sums of counts and count-weighted means
+    w = np.concatenate([[0], np.cumsum(counts)])
+    s = np.concatenate([[0], np.cumsum(counts * means)])
+
+    # cost of a class spanning buckets [i, j) is the weighted squared mean (S_j - S_i)**2 / (W_j - W_i)
+    # maximizing the sum of these is equivalent to maximizing between-class variance
+    dw = w[np.newaxis, :] - w[:, np.newaxis]
+    ds = s[np.newaxis, :] - s[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cost = np.where(dw > 0, ds ** 2 / dw, -np.inf)
+
+    # best[j] is the score of splitting the first j buckets into k classes
+    best = cost[0].copy()
+    splits = []
+    for _ in range(1, n_classes):
+        candidates = best[:, np.newaxis] + cost
+        splits.append(candidates.argmax(axis=0))
+        best = candidates.max(axis=0)
+
+    # backtrack the bucket indices of the class boundaries from the full histogram
+    boundaries = []
+    j = n
+    for split in reversed(splits):
+        j = split[j]
+        boundaries.append(j)
+
+    return [float(means[b - 1]) for b in sorted(boundaries)]
+
+
 def kmeans_extent(img, hand, initial_threshold=0, region=None, band=None, scale=90):
     """Water thresholding methodology using image values and HAND.
     Method taken from https://doi.org/10.1016/j.rse.2020.111732
@@ -309,3 +332,624 @@ def kmeans_extent(img, hand, initial_threshold=0, region=None, band=None, scale=
 
     return water.rename("water").uint8()
 
+
+def kmeans_extent_local(
+    img,
+    hand,
+    initial_threshold=0,
+    n_clusters=2,
+    class_points=500,
+    batch_size=256,
+    max_iter=100,
+    tol=1e-4,
+    chunk_size=2 ** 20,
+    seed=7,
+    nodata=255,
+):
+    """Local equivalent of `kmeans_extent` for image and HAND arrays.
+    Samples are stratified by the initial threshold, clustered with a mini-batch KMeans
+    and then every pixel is assigned to the nearest centroid in chunks so memory is bounded by `chunk_size`
+
+    args:
+        img (numpy.ndarray): 2-D input image array to threshold, non-finite values are treated as masked
+        hand (numpy.ndarray): 2-D Height Above Nearest Drainage array with the same shape as `img`, non-finite values are set to 0
+        initial_threshold (float, optional): initial estimate of water/no-water for stratified sampling. default = 0
+        n_clusters (int, optional): number of clusters to find. default = 2
+        class_points (int, optional): number of samples to take for each strata. default = 500
+        batch_size (int, optional): number of samples used to update centroids each iteration. default = 256
+        max_iter (int, optional): maximum number of mini-batch iterations. default = 100
+        tol (float, optional): maximum change in centroid position to consider the clustering converged. default = 1e-4
+        chunk_size (int, optional): number of pixels to process at one time when sampling and assigning clusters. default = 2**20
+        seed (int, optional): random number generator seed used for sampling and clustering. default = 7
+        nodata (int, optional): value to set for masked pixels in the output. default = 255
+
+    returns:
+        numpy.ndarray: uint8 array of cluster labels ordered by ascending centroid image value (i.e. 0 is the cluster with lowest values)
+
+    raises:
+        ValueError: if `img` and `hand` do not have the same shape
+    """
+    img = np.asarray(img)
+    hand = np.asarray(hand)
+    if img.shape != hand.shape:
+        raise ValueError(
+            f"img and hand arrays expected to have same shape, got {img.shape} and {hand.shape}"
+        )
+
+    rng = np.random.default_rng(seed)
+    n_rows, n_cols = img.shape
+    step = max(1, chunk_size // n_cols)
+
+    def _features(r0, r1):
+        """Closure function to get the features and valid mask of a chunk of rows
+        """
+        x = img[r0:r1].astype(np.float64).ravel()
+        h = np.nan_to_num(hand[r0:r1].astype(np.float64).ravel(), nan=0, posinf=0, neginf=0)
+        return np.stack([x, h], axis=-1), np.isfinite(x)
+
+    # count the pixels within each strata for every chunk
+    chunks = list(range(0, n_rows, step))
+    counts = np.zeros((len(chunks), 2), dtype=np.int64)
+    for i, r0 in enumerate(chunks):
+        x, valid = _features(r0, r0 + step)
+        strata = x[valid, 0] > initial_threshold
+        counts[i] = [np.count_nonzero(~strata), np.count_nonzero(strata)]
+
+    # allocate samples for each strata across chunks proportionally to the pixel counts
+    totals = counts.sum(axis=0)
+    allocation = np.zeros_like(counts)
+    for s in range(2):
+        n = min(class_points, totals[s])
+        if n > 0:
+            allocation[:, s] = rng.multivariate_hypergeometric(counts[:, s], n)
+
+    samples = []
+    for i, r0 in enumerate(chunks):
+        if allocation[i].sum() == 0:
+            continue
+        x, valid = _features(r0, r0 + step)
+        x = x[valid]
+        strata = x[:, 0] > initial_threshold
+        for s in range(2):
+            idx = np.flatnonzero(strata == bool(s))
+            samples.append(x[rng.choice(idx, allocation[i, s], replace=False)])
+
+    samples = np.concatenate(samples) if samples else np.empty((0, 2))
+    if samples.shape[0] < n_clusters:
+        raise ValueError(
+            f"not enough valid pixels to sample {n_clusters} clusters, found {samples.shape[0]}"
+        )
+
+    # min/max normalize features as the Weka Euclidean distance does
+    fmin = samples.min(axis=0)
+    frange = samples.max(axis=0) - fmin
+    frange[frange == 0] = 1
+
+    centroids = _minibatch_kmeans(
+        (samples - fmin) / frange,
+        n_clusters,
+        batch_size=batch_size,
+        max_iter=max_iter,
+        tol=tol,
+        rng=rng,
+    )
+    # relabel clusters by ascending image value so labels are deterministic
+    centroids = centroids[np.argsort(centroids[:, 0])]
+
+    out = np.full(img.shape, nodata, dtype=np.uint8)
+    out_flat = out.reshape(-1)
+    for r0 in chunks:
+        x, valid = _features(r0, r0 + step)
+        labels = _nearest_centroid((x[valid] - fmin) / frange, centroids)
+        chunk = out_flat[r0 * n_cols : min(r0 + step, n_rows) * n_cols]
+        chunk[valid] = labels
+
+    return out
+
+
+def collection_thresholds(
+    dataset,
+    method="edge_otsu",
+    band=None,
+    region=None,
+    invert=False,
+    return_collection=False,
+    **kwargs,
+):
+    """Function to calculate Otsu thresholds for every image in a collection with one request.
+    The per-image histograms are calculated within a mapped reduction so all thresholds
+    are returned together as a table rather than pulling each threshold separately
+
+    args:
+        dataset (ee.ImageCollection | hydrafloods.Dataset): image collection to calculate thresholds for
+        method (str, optional): name of thresholding method used to sample the histogram.
+            options are "otsu", "edge_otsu", "bmax_otsu". default = "edge_otsu"
+        band (str | None,optional): band name to use for thresholding, if set to `None` will use first band in image. default = None
+        region (ee.Geometry | None, optional): region to determine threshold, if set to `None` will use geometry of each image. default = None
+        invert (bool, optional): boolean switch to determine if to threshold greater than (True) or less than (False). default = False
+        return_collection (bool, optional): boolean switch, if set to true then function will return the collection of thresholded images
+            with the threshold set as a property, else table of thresholds. default = False
+        **kwargs: additional keywords passed to the method's histogram sampling (i.e. `scale`, `initial_threshold`, `edge_buffer`)
+
+    returns:
+        ee.FeatureCollection | ee.ImageCollection: table with "system:index", "system:time_start" and "threshold" properties for each image 
+            (if return_collection==False) or collection of thresholded images with a "threshold" property (if return_collection==True)
+
+    raises:
+        ValueError: if method is not one of the available options
+    """
+
+    def _image_threshold(img):
+        """Closure function to calculate the threshold for an image
+        """
+        if band is None:
+            img = img.select([0])
+            hist_band = ee.String(img.bandNames().get(0))
+        else:
+            hist_band = ee.String(band)
+            img = img.select(hist_band)
+
+        img_region = img.geometry() if region is None else region
+
+        histogram = histogram_func(img, hist_band, img_region, **kwargs)
+
+        return img, otsu(histogram)
+
+    def _threshold_feature(img):
+        """Closure function to calculate the threshold for an image as a feature in a table
+        """
+        _, threshold = _image_threshold(img)
+        return ee.Feature(None, {"threshold": threshold}).copyProperties(
+            img, ["system:index", "system:time_start"]
+        )
+
+    @decorators.carry_metadata
+    def _threshold_image(img):
+        """Closure function to apply the threshold calculated for an image
+        """
+        img, threshold = _image_threshold(img)
+        water = ee.Image(ee.Algorithms.If(invert, img.gt(threshold), img.lt(threshold)))
+        return water.rename("water").uint8().set("threshold", threshold)
+
+    histogram_func = _histogram_method(method)
+
+    if not isinstance(dataset, ee.ImageCollection):
+        dataset = dataset.collection
+
+    if return_collection:
+        return dataset.map(_threshold_image)
+    else:
+        return ee.FeatureCollection(dataset.map(_threshold_feature))
+
+
+def tile_thresholds(
+    img, band=None, region=None, method="edge_otsu", grid_size=0.5, **kwargs
+):
+    """Function to calculate Otsu thresholds for each tile of a coarse grid covering a region.
+    Thresholds for all tiles are calculated within one mapped reduction along with quality metrics for each tile
+
+    args:
+        img (ee.Image): input image to calculate thresholds for
+        band (str | None,optional): band name to use for thresholding, if set to `None` will use first band in image. default = None
+        region (ee.Geometry | None, optional): region to tile, if set to `None` will use img.geometry(). default = None
+        method (str, optional): name of thresholding method used to sample the histogram within each tile.
+            options are "otsu", "edge_otsu", "bmax_otsu". default = "edge_otsu"
+        grid_size (float, optional): size in decimal degrees of the tiles. default = 0.5
+        **kwargs: additional keywords passed to the method's histogram sampling (i.e. `scale`, `initial_threshold`, `edge_buffer`)
+
+    returns:
+        ee.FeatureCollection: collection of tiles with "threshold", "count" (number of pixels in histogram) and "separability"
+            (ratio of between-class to total variance, 0-1) properties. Tiles without valid pixels will not have these properties
+
+    raises:
+        ValueError: if method is not one of the available options
+    """
+
+    def _tile_threshold(feature):
+        """Closure function to calculate the threshold and quality for a tile
+        """
+        histogram = histogram_func(img, hist_band, feature.geometry(), **kwargs)
+        threshold = otsu(histogram)
+        count, separability = _otsu_separability(histogram, threshold)
+        stats = ee.Algorithms.If(
+            histogram,
+            ee.Dictionary(
+                {"threshold": threshold, "count": count, "separability": separability}
+            ),
+            ee.Dictionary({}),
+        )
+        return feature.set(stats)
+
+    histogram_func = _histogram_method(method)
+
+    if band is None:
+        img = img.select([0])
+        hist_band = ee.String(img.bandNames().get(0))
+    else:
+        hist_band = ee.String(band)
+        img = img.select(hist_band)
+
+    if region is None:
+        region = img.geometry()
+
+    grid = geeutils.tile_region(region, intersect_geom=region, grid_size=grid_size)
+
+    return grid.map(_tile_threshold)
+
+
+@decorators.carry_metadata
+def adaptive_threshold(
+    img,
+    band=None,
+    region=None,
+    method="edge_otsu",
+    grid_size=0.5,
+    invert=False,
+    min_count=100,
+    min_separability=0,
+    return_threshold=False,
+    **kwargs,
+):
+    """Spatially adaptive thresholding using a smooth threshold surface rather than a single global value.
+    Thresholds are calculated for tiles of a coarse grid with `tile_thresholds` and bilinearly interpolated
+    between tile centers to create a threshold image that is applied per pixel. Tiles that fail the quality
+    checks are filled from neighboring tiles or the mean of all valid tiles.
+
+    args:
+        img (ee.Image): input image to thresholding algorithm
+        band (str | None,optional): band name to use for thresholding, if set to `None` will use first band in image. default = None
+        region (ee.Geometry | None, optional): region to determine thresholds, if set to `None` will use img.geometry(). default = None
+        method (str, optional): name of thresholding method used to sample the histogram within each tile.
+            options are "otsu", "edge_otsu", "bmax_otsu". default = "edge_otsu"
+        grid_size (float, optional): size in decimal degrees of the tiles. default = 0.5
+        invert (bool, optional): boolean switch to determine if to threshold greater than (True) or less than (False). default = False
+        min_count (int, optional): minimum number of histogram pixels for a tile threshold to be used. default = 100
+        min_separability (float, optional): minimum ratio of between-class to total variance (0-1) for a tile threshold to be used. default = 0
+        return_threshold (bool, optional): boolean switch, if set to true then function will return threshold surface image, else thresholded image. default = False
+        **kwargs: additional keywords passed to the method's histogram sampling (i.e. `scale`, `initial_threshold`, `edge_buffer`)
+
+    returns:
+        ee.Image: thresholded image (if return_threshold==False) or threshold surface image named "threshold" (if return_threshold==True)
+    """
+    if band is None:
+        img = img.select([0])
+    else:
+        img = img.select(band)
+
+    tiles = tile_thresholds(
+        img, region=region, method=method, grid_size=grid_size, **kwargs
+    ).filter(
+        ee.Filter.And(
+            ee.Filter.notNull(["threshold"]),
+            ee.Filter.gte("count", min_count),
+            ee.Filter.gte("separability", min_separability),
+        )
+    )
+
+    # grid from `geeutils.tile_region` is aligned to multiples of grid_size
+    # so one pixel of the coarse projection is one tile and pixel centers are tile centers
+    coarse_proj = ee.Projection("EPSG:4326").scale(grid_size, grid_size)
+
+    surface = (
+        ee.Image()
+        .float()
+        .paint(tiles, "threshold")
+        .rename("threshold")
+        .reproject(coarse_proj)
+    )
+    surface = (
+        surface.unmask(surface.focal_mean(1, "square", "pixels"))
+        .unmask(ee.Number(tiles.aggregate_mean("threshold")))
+        .reproject(coarse_proj)
+        .resample("bilinear")
+    )
+
+    if return_threshold is True:
+        return surface
+    else:
+        water = ee.Image(ee.Algorithms.If(invert, img.gt(surface), img.lt(surface)))
+        return water.rename("water").uint8()
+
+
+def _cached_otsu(img, hist_band, region, method, histogram_func, params, cache=None):
+    """Private helper function to calculate an Otsu threshold, consulting the threshold cache before issuing reductions
+    """
+    threshold = otsu(histogram_func(img, hist_band, region, **params))
+
+    if cache is None:
+        return threshold
+
+    try:
+        key = cache.key(img, method, region=region, **params)
+    except EEException:
+        # mapped images are placeholders that cannot be serialized or evaluated client-side
+        raise ValueError(
+            f"cache cannot be used for {method} within a mapped function as it requires client-side requests, "
+            "use collection_thresholds() to calculate thresholds for a collection"
+        )
+    value = cache.get(key)
+    if value is None:
+        value = threshold.getInfo()
+        cache.set(key, value, method=method)
+
+    # fall back to the server-side threshold if no value could be calculated
+    return ee.Number(value) if value is not None else threshold
+
+
+def _histogram_method(method):
+    """Private helper function to get the histogram sampling function for a thresholding method
+    """
+    methods = {
+        "otsu": _region_histogram,
+        "edge_otsu": _edge_histogram,
+        "bmax_otsu": _bmax_histogram,
+    }
+    if method not in methods:
+        raise ValueError(
+            f"method argument expected one of {list(methods.keys())}, got '{method}'"
+        )
+
+    return methods[method]
+
+
+def _otsu_separability(histogram, threshold):
+    """Private helper function to calculate the number of pixels in a histogram and the ratio
+    of between-class variance to total variance when split at threshold
+    """
+    counts = ee.Array(ee.Dictionary(histogram).get("histogram"))
+    means = ee.Array(ee.Dictionary(histogram).get("bucketMeans"))
+    size = means.length().get([0])
+    lower = means.lte(ee.Array(ee.List.repeat(threshold, size)))
+
+    def _sum(arr):
+        return arr.reduce(ee.Reducer.sum(), [0]).get([0])
+
+    weighted = means.multiply(counts)
+    total = _sum(counts)
+    mean = _sum(weighted).divide(total)
+    variance = _sum(weighted.multiply(means)).divide(total).subtract(mean.pow(2))
+
+    a_count = _sum(counts.multiply(lower))
+    a_mean = _sum(weighted.multiply(lower)).divide(a_count)
+    b_count = total.subtract(a_count)
+    b_mean = _sum(weighted).subtract(a_mean.multiply(a_count)).divide(b_count)
+
+    between = (
+        a_count.multiply(b_count)
+        .multiply(a_mean.subtract(b_mean).pow(2))
+        .divide(total.pow(2))
+    )
+
+    return total, between.divide(variance)
+
+
+def _histogram_reducer(max_buckets, min_bucket_width, max_raw):
+    """Private helper function to get the histogram reducer used for Otsu thresholding
+    """
+    return (
+        ee.Reducer.histogram(max_buckets, min_bucket_width, max_raw)
+        .combine("mean", None, True)
+        .combine("variance", None, True)
+    )
+
+
+def _region_histogram(
+    img,
+    hist_band,
+    region,
+    scale=90,
+    max_buckets=255,
+    min_bucket_width=0.001,
+    max_raw=1e6,
+):
+    """Private helper function to calculate the histogram of all pixels in region
+    """
+    histogram = img.reduceRegion(
+        _histogram_reducer(max_buckets, min_bucket_width, max_raw),
+        region,
+        scale,
+        bestEffort=True,
+        tileScale=16,
+    )
+    return ee.Dictionary(histogram.get(ee.String(hist_band).cat("_histogram")))
+
+
+def _edge_histogram(
+    img,
+    hist_band,
+    region,
+    scale=90,
+    initial_threshold=0,
+    canny_threshold=0.05,
+    canny_sigma=0,
+    canny_lt=0.05,
+    connected_pixels=200,
+    edge_length=50,
+    edge_buffer=100,
+    max_buckets=255,
+    min_bucket_width=0.001,
+    max_raw=1e6,
+):
+    """Private helper function to calculate the histogram of pixels buffered around edges used for `edge_otsu`
+    """
+    binary = img.lt(initial_threshold).rename("binary")
+
+    # get canny edges
+    canny = ee.Algorithms.CannyEdgeDetector(binary, canny_threshold, canny_sigma)
+    # process canny edges
+    connected = (
+        canny.mask(canny).lt(canny_lt).connectedPixelCount(connected_pixels, True)
+    )
+    edges = connected.gte(edge_length)
+    edgeBuffer = edges.focal_max(edge_buffer, "square", "meters")
+
+    # mask out areas to get histogram for Otsu
+    histogram_image = img.updateMask(edgeBuffer)
+
+    return _region_histogram(
+        histogram_image,
+        hist_band,
+        region,
+        scale=scale,
+        max_buckets=max_buckets,
+        min_bucket_width=min_bucket_width,
+        max_raw=max_raw,
+    )
+
+
+def _bmax_histogram(
+    img,
+    hist_band,
+    region,
+    scale=90,
+    initial_threshold=0,
+    grid_size=0.1,
+    bmax_threshold=0.75,
+    max_boxes=100,
+    seed=7,
+    max_buckets=255,
+    min_bucket_width=0.001,
+    max_raw=1e6,
+):
+    """Private helper function to calculate the histogram of bimodal tiles used for `bmax_otsu`
+    """
+
+    def calcBmax(feature):
+        """Closure function to calculate Bmax for each feature covering image
+        """
+        segment = img
+        initial = segment.lt(initial_threshold)
+        p1 = ee.Number(
+            initial.reduceRegion(
+                reducer=ee.Reducer.mean(),
+                geometry=feature.geometry(),
+                bestEffort=True,
+                scale=scale,
+            ).get(hist_band)
+        )
+        p1 = ee.Number(ee.Algorithms.If(p1, p1, 0.99))
+        p2 = ee.Number(1).subtract(p1)
+
+        m = (
+            segment.updateMask(initial)
+            .rename("m1")
+            .addBands(segment.updateMask(initial.Not()).rename("m2"))
+        )
+
+        mReduced = m.reduceRegion(
+            reducer=ee.Reducer.mean(),
+            geometry=feature.geometry(),
+            bestEffort=True,
+            scale=scale,
+        )
+
+        m1 = ee.Number(mReduced.get("m1"))
+        m2 = ee.Number(mReduced.get("m2"))
+
+        m1 = ee.Number(ee.Algorithms.If(m1, m1, -25))
+        m2 = ee.Number(ee.Algorithms.If(m2, m2, 0))
+
+        sigmab = p1.multiply(p2.multiply(m1.subtract(m2).pow(2)))
+        sigmat = ee.Number(
+            segment.reduceRegion(
+                reducer=ee.Reducer.variance(),
+                geometry=feature.geometry(),
+                bestEffort=True,
+                scale=scale,
+            ).get(hist_band)
+        )
+        sigmat = ee.Number(ee.Algorithms.If(sigmat, sigmat, 2))
+        bmax = sigmab.divide(sigmat)
+        return feature.set({"bmax": bmax})
+
+    grid = geeutils.tile_region(region, intersect_geom=region, grid_size=grid_size)
+
+    bmaxes = (
+        grid.map(calcBmax)
+        .filter(ee.Filter.gt("bmax", bmax_threshold))
+        .randomColumn("random", seed)
+    )
+
+    nBoxes = ee.Number(bmaxes.size())
+    randomThresh = ee.Number(max_boxes).divide(nBoxes)
+    selection = bmaxes.filter(ee.Filter.lt("random", randomThresh))
+
+    return _region_histogram(
+        img,
+        hist_band,
+        selection,
+        scale=scale,
+        max_buckets=max_buckets,
+        min_bucket_width=min_bucket_width,
+        max_raw=max_raw,
+    )
+
+
+def _nearest_centroid(x, centroids):
+    """Private helper function to get the index of the nearest centroid for each sample using broadcasting
+    """
+    if jit.enabled():
+        return _nearest_centroid_kernel(x, centroids)
+
+    d = ((x[:, np.newaxis, :] - centroids[np.newaxis, :, :]) ** 2).sum(axis=-1)
+    return d.argmin(axis=1)
+
+
+@jit.njit
+def _nearest_centroid_kernel(x, centroids):
+    """Private helper function to get the index of the nearest centroid for each sample in compiled loops
+    without the (sample, centroid, feature) intermediate array
+    """
+    labels = np.empty(x.shape[0], dtype=np.int64)
+    for i in range(x.shape[0]):
+        best, best_d = 0, np.inf
+        for c in range(centroids.shape[0]):
+            d = 0.0
+            for f in range(x.shape[1]):
+                d += (x[i, f] - centroids[c, f]) ** 2
+            if d < best_d:
+                best, best_d = c, d
+        labels[i] = best
+
+    return labels
+
+
+def _minibatch_kmeans(x, n_clusters, batch_size=256, max_iter=100, tol=1e-4, rng=None):
+    """Private helper function to find cluster centroids with vectorized mini-batch KMeans.
+    Centroids are initialized with kmeans++ and updated with per-centroid learning rates (Sculley, 2010)
+    """
+    if rng is None:
+        rng = np.random.default_rng(7)
+
+    n = x.shape[0]
+
+    # kmeans++ initialization
+    centroids = np.empty((n_clusters, x.shape[1]))
+    centroids[0] = x[rng.integers(n)]
+    for k in range(1, n_clusters):
+        d = ((x[:, np.newaxis, :] - centroids[np.newaxis, :k, :]) ** 2).sum(-1).min(1)
+        p = d / d.sum() if d.sum() > 0 else None
+        centroids[k] = x[rng.choice(n, p=p)]
+
+    seen = np.zeros(n_clusters)
+    for _ in range(max_iter):
+        batch = x[rng.choice(n, min(batch_size, n), replace=False)]
+        labels = _nearest_centroid(batch, centroids)
+
+        batch_counts = np.bincount(labels, minlength=n_clusters).astype(np.float64)
+        batch_sums = np.zeros_like(centroids)
+        np.add.at(batch_sums, labels, batch)
+
+        seen += batch_counts
+        updated = batch_counts > 0
+        previous = centroids.copy()
+        # aggregated per-sample gradient steps with learning rate 1 / count
+        centroids[updated] += (
+            batch_sums[updated]
+            - batch_counts[updated, np.newaxis] * centroids[updated]
+        ) / seen[updated, np.newaxis]
+
+        if np.abs(centroids - previous).max() < tol:
+            break
+
+    return centroids
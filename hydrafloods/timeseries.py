@@ -1,6 +1,8 @@
 import ee
 import math
 import copy
+import functools
+import numpy as np
 from functools import partial
 from hydrafloods import decorators, datasets
 
@@ -65,19 +67,27 @@ def _get_names(base, n):
     return ee.List([f"{base}_{i}" for i in range(1, n + 1)])
 
 
-def add_harmonic_coefs(image, n_cycles=2):
+def add_harmonic_coefs(image, n_cycles=2, from_date=False):
     """Function to add harmonic coefficients as bands to images
     Harmonic coefficients are calculated as sin and cos of frequency within year
 
     args:
         image (ee.Image): image object to add harmonic coefficiencts to. Expects that image has time band
         n_cycles (int, optional): number of interannual cycles to include. default = 2
+        from_date (bool, optional): switch to take the coefficients from `harmonic_basis()` of the image date
+            as constants instead of calculating them from the time band for every pixel. Expects that image has
+            `system:time_start` property. default = False
 
     returns:
         ee.Image: image with harmonic coefficient bands added
     """
     cosNames = _get_names("cos", n_cycles)
     sinNames = _get_names("sin", n_cycles)
+
+    if from_date:
+        basis = harmonic_basis(image.date(), n_cycles=n_cycles)
+        return image.addBands(basis.select(cosNames.cat(sinNames)))
+
     frequencyImg = ee.Image.constant(ee.List.sequence(1, n_cycles))
     timeRadians = image.select("time").multiply(2 * math.pi)
     cosines = timeRadians.multiply(frequencyImg).cos().rename(cosNames)
@@ -176,6 +186,8 @@ def fit_harmonic_trend(
     independents=["constant", "time"],
     dependent=None,
     output_err=False,
+    output_stats=False,
+    sufficient_stats=None,
 ):
     """Function to fit a harmonic trend on image collection along the time dimension.
     Uses ee.Reducer.linearRegression to solve for coefficients
@@ -187,10 +199,14 @@ def fit_harmonic_trend(
         dependent (str | None, optional): band name of values to fit, if None then uses the first band. default = None
         output_err (bool, optional): switch to output regression x and y errors, if true output will have "mean_x", "residual_x" and "residual_y" bands. 
             Useful for estimating confidence intervals. default = False
+        output_stats (bool, optional): switch to output the sufficient statistics of the fit as array bands "xtx" (k x k) and "xty" (k x 1)
+            and band "yy" so that the fit can be updated with new observations later. default = False
+        sufficient_stats (ee.Image | None, optional): image with "xtx", "xty", "n" and "yy" bands from a previous fit. Observations in collection
+            are added to the statistics before solving so only new imagery needs to be included in collection. default = None
 
     returns:
         ee.Image: output image with regression coeffients as bands named "constant", "time", "cos_n", and "sin_n" where n is a sequnces of cycles. 
-            Will have "mean_x", "residual_x" and "residual_y" if ouput_err == True
+            Will have "mean_x", "residual_x" and "residual_y" if ouput_err == True and "xtx", "xty" and "yy" if output_stats == True
 
     raises:
         ValueError: if collection is not of type ee.ImageCollection or hydrafloods.Dataset
@@ -207,18 +223,29 @@ def fit_harmonic_trend(
     else:
         dependent = ee.String(dependent)
 
-    independents = (
-        ee.List(independents)
-        .cat(_get_names("cos", n_cycles))
-        .cat(_get_names("sin", n_cycles))
+    x_names = (
+        list(independents)
+        + [f"cos_{i}" for i in range(1, n_cycles + 1)]
+        + [f"sin_{i}" for i in range(1, n_cycles + 1)]
     )
+    independents = ee.List(x_names)
 
-    _add_coefs = partial(add_harmonic_coefs, n_cycles=n_cycles)
+    _add_coefs = partial(add_harmonic_coefs, n_cycles=n_cycles, from_date=True)
 
     harmonic_collection = prep_inputs(
         collection, keep_bands=[dependent], apply_mask=True
     ).map(_add_coefs)
 
+    if output_stats or sufficient_stats is not None:
+        return _fit_sufficient_stats(
+            harmonic_collection,
+            x_names,
+            dependent,
+            output_err=output_err,
+            output_stats=output_stats,
+            sufficient_stats=sufficient_stats,
+        )
+
     harmonic_trend = harmonic_collection.select(independents.add(dependent)).reduce(
         ee.Reducer.linearRegression(numX=independents.length(), numY=1), 16
     )
@@ -254,6 +281,77 @@ def fit_harmonic_trend(
 
 
 
+def _fit_sufficient_stats(
+    collection,
+    independents,
+    dependent,
+    output_err=False,
+    output_stats=False,
+    sufficient_stats=None,
+):
+    """Private helper function to fit a least squares regression on an image collection from sufficient statistics.
+    Statistics are summed as scalar bands across the collection then packed as array bands to solve
+    """
+
+    def _products(img):
+        """Closure function to calculate the cross products of an image's independent and dependent values
+        """
+        y = img.select(dependent)
+        x = img.select(independents).updateMask(y.mask())
+        xx = [x.select(i).multiply(x.select(j)) for i in range(k) for j in range(k)]
+        return ee.Image.cat(
+            xx + [x.multiply(y), y.multiply(y), ee.Image(1).updateMask(y.mask().gt(0))]
+        ).rename(xx_names + xy_names + ["yy", "n"]).double()
+
+    k = len(independents)
+    xx_names = [f"xtx_{i}_{j}" for i in range(k) for j in range(k)]
+    xy_names = [f"xty_{i}" for i in range(k)]
+
+    stats = collection.map(_products).sum().unmask(0)
+
+    xtx = stats.select(xx_names).toArray().arrayReshape(ee.Image([k, k]).toArray(), 2)
+    xty = stats.select(xy_names).toArray().toArray(1)
+    n = stats.select("n")
+    yy = stats.select("yy")
+
+    if sufficient_stats is not None:
+        sufficient_stats = ee.Image(sufficient_stats)
+        xtx = xtx.add(sufficient_stats.select("xtx"))
+        xty = xty.add(sufficient_stats.select("xty"))
+        n = n.add(sufficient_stats.select("n"))
+        yy = yy.add(sufficient_stats.select("yy"))
+
+    beta = xtx.matrixSolve(xty).updateMask(n.gte(k))
+
+    coefficients = beta.arrayProject([0]).arrayFlatten([independents])
+    out = coefficients.addBands(n.rename("n"))
+
+    if output_err:
+        # sse = y'y - 2b'X'y + b'X'Xb
+        bt = beta.matrixTranspose()
+        sse = (
+            yy.subtract(bt.matrixMultiply(xty).arrayGet([0, 0]).multiply(2))
+            .add(bt.matrixMultiply(xtx).matrixMultiply(beta).arrayGet([0, 0]))
+            .max(0)
+        )
+        residual_y = sse.divide(n).sqrt().rename("residual_y")
+
+        ci, ti = independents.index("constant"), independents.index("time")
+        mean_x = xtx.arrayGet([ci, ti]).divide(n).rename("mean_x")
+        residual_x = (
+            xtx.arrayGet([ti, ti])
+            .subtract(n.multiply(mean_x.pow(2)))
+            .rename("residual_x")
+        )
+
+        out = ee.Image.cat([out, residual_y, mean_x, residual_x])
+
+    if output_stats:
+        out = ee.Image.cat([out, xtx.rename("xtx"), xty.rename("xty"), yy.rename("yy")])
+
+    return out
+
+
 def predict_harmonics(
     collection, harmonics, n_cycles=2, independents=["constant", "time"]
 ):
@@ -287,7 +385,7 @@ def predict_harmonics(
         .cat(_get_names("sin", n_cycles))
     )
 
-    _add_coefs = partial(add_harmonic_coefs, n_cycles=n_cycles)
+    _add_coefs = partial(add_harmonic_coefs, n_cycles=n_cycles, from_date=True)
 
     harmonic_collection = prep_inputs(collection).map(_add_coefs)
 
@@ -297,6 +395,46 @@ def predict_harmonics(
     return predicted
 
 
+def harmonic_basis(t, n_cycles=2):
+    """Function to get the harmonic regression independents for a date as a constant image with
+    "constant", "time", "cos_n" and "sin_n" bands. The values are calculated once as numbers and folded into
+    the image as constants instead of being calculated per pixel. Results are memoized by date and n_cycles
+    so repeated fits and predictions for a date reuse the same object
+
+    args:
+        t (str | ee.Date | datetime.datetime): date to calculate independents for
+        n_cycles (int, optional): number of interannual cycles to include. default = 2
+
+    returns:
+        ee.Image: constant image with harmonic independent bands
+    """
+    return _harmonic_basis_image(t, n_cycles)
+
+
+@functools.lru_cache(maxsize=4096)
+def _harmonic_basis_image(t, n_cycles):
+    """Private helper function to build the constant harmonic independents image of `harmonic_basis()`.
+    Cached on (t, n_cycles), ee objects hash and compare by their serialized value so equal dates share an entry
+    """
+    date = t if isinstance(t, ee.Date) else ee.Date(t)
+    time = date.difference(ee.Date("1970-01-01"), "year")
+    radians = [time.multiply(2 * math.pi * i) for i in range(1, n_cycles + 1)]
+    values = ee.List(
+        [1, time] + [r.cos() for r in radians] + [r.sin() for r in radians]
+    )
+    names = (
+        ee.List(["constant", "time"])
+        .cat(_get_names("cos", n_cycles))
+        .cat(_get_names("sin", n_cycles))
+    )
+
+    return (
+        ee.Image.constant(values)
+        .rename(names)
+        .set("system:time_start", date.millis())
+    )
+
+
 def get_dummy_img(t):
     """Helper function to get an image readily available to use for predictions
     Resulting image will include time based on year and constant band of 1
@@ -341,13 +479,15 @@ def get_dummy_collection(start_time, end_time):
 
     return prep_inputs(coll)
 
-def temporal_smoothing(collection,reducer,days=10):
+def temporal_smoothing(collection,reducer,days=10,use_join=False):
     """Function to apply moving window reducer in time on image collection
-    
+
     args:
         collection (ee.ImageCollection): image collection to apply moving window reducer in time on
         reducer (ee.Reducer): earth engine reducer object to apply
         days (int,optional): size of moving time window in days to apply reducer. default = 10
+        use_join (bool, optional): switch to find the images within each window with one join
+            instead of filtering the collection once per image. default = False
 
     returns:
         ee.ImageCollection: image collection with reducer applied in time
@@ -362,4 +502,996 @@ def temporal_smoothing(collection,reducer,days=10):
         t_stop = t.advance(days//2, "day")
         return collection.filterDate(t_start,t_stop).reduce(reducer,8).rename(band_names)
 
-    return collection.map(_smooth)
\ No newline at end of file
+    def _smooth_joined(img):
+        """Closure function to apply smoothing on the images joined to the window
+        """
+        img = ee.Image(img)
+        window = ee.ImageCollection.fromImages(img.get("window"))
+        return ee.Image(
+            window.reduce(reducer, 8)
+            .rename(img.bandNames())
+            .copyProperties(img, exclude=["window", "window_start", "window_end"])
+            .set("system:time_start", img.get("system:time_start"))
+        )
+
+    if use_join:
+        # same [t + (-days)//2, t + days//2) window as filterDate, the lower half is the larger one for odd days
+        lower = (-days // 2) * 86400000
+        upper = (days // 2) * 86400000
+        keyed = collection.map(
+            lambda img: img.set(
+                {
+                    "window_start": ee.Number(img.get("system:time_start")).add(lower),
+                    "window_end": ee.Number(img.get("system:time_start")).add(upper),
+                }
+            )
+        )
+        window_filter = ee.Filter.And(
+            ee.Filter.lessThanOrEquals(leftField="window_start", rightField="system:time_start"),
+            ee.Filter.greaterThan(leftField="window_end", rightField="system:time_start"),
+        )
+        joined = ee.Join.saveAll("window").apply(keyed, collection, window_filter)
+        return ee.ImageCollection(joined).map(_smooth_joined)
+
+    return collection.map(_smooth)
+
+
+def init_trend_state(date, level_variance=1.0, trend_variance=0.01):
+    """Function to create an initial state image for the recursive local linear trend model.
+    The state starts with zero level and trend and a diffuse covariance so the first observations dominate
+
+    args:
+        date (str | ee.Date): date the state is valid for, i.e. the day before the first observation
+        level_variance (float, optional): initial variance of the level. default = 1.0
+        trend_variance (float, optional): initial variance of the trend (units per day). default = 0.01
+
+    returns:
+        ee.Image: state image with level, trend, p00, p01, p11 and time bands
+    """
+    if not isinstance(date, ee.Date):
+        date = ee.Date(date)
+
+    t = date.difference(ee.Date("1970-01-01"), "day")
+
+    return (
+        ee.Image.constant([0, 0, level_variance, 0, trend_variance, t])
+        .double()
+        .rename(["level", "trend", "p00", "p01", "p11", "time"])
+        .set("system:time_start", date.millis())
+    )
+
+
+def kalman_trend_update(
+    state, observation, date, process_noise=1e-4, observation_noise=1e-2
+):
+    """Function to recursively update a per-pixel local linear trend (level + trend) model with a
+    Kalman filter. Each call advances the state to `date` and, where `observation` is valid, assimilates
+    the new value so only one image is needed per update instead of refitting over a look back window.
+    Pixels where the observation is masked keep the predicted state.
+
+    args:
+        state (ee.Image): state image with level, trend, p00, p01, p11 and time bands,
+            see `init_trend_state()` or the output from a previous update
+        observation (ee.Image | None): single band image of the new observation. If None then only
+            the prediction step is applied, i.e. forecast the state to `date`
+        date (str | ee.Date): date of observation
+        process_noise (float, optional): spectral density of the random trend changes (units per day^2).
+            Larger values allow the trend to adapt faster. default = 1e-4
+        observation_noise (float, optional): variance of the observations. default = 1e-2
+
+    returns:
+        ee.Image: updated state image with level, trend, p00, p01, p11 and time bands
+    """
+    if not isinstance(date, ee.Date):
+        date = ee.Date(date)
+
+    state = ee.Image(state)
+    band_names = ["level", "trend", "p00", "p01", "p11", "time"]
+
+    t = ee.Image.constant(date.difference(ee.Date("1970-01-01"), "day")).double()
+    dt = t.subtract(state.select("time"))
+    q = ee.Image.constant(process_noise)
+
+    level = state.select("level")
+    trend = state.select("trend")
+    p00 = state.select("p00")
+    p01 = state.select("p01")
+    p11 = state.select("p11")
+
+    # prediction step with integrated random walk on the trend
+    level_pred = level.add(trend.multiply(dt))
+    p00_pred = (
+        p00.add(p01.multiply(dt).multiply(2))
+        .add(p11.multiply(dt.pow(2)))
+        .add(q.multiply(dt.pow(3)).divide(3))
+    )
+    p01_pred = p01.add(p11.multiply(dt)).add(q.multiply(dt.pow(2)).divide(2))
+    p11_pred = p11.add(q.multiply(dt))
+
+    predicted = ee.Image.cat(
+        [level_pred, trend, p00_pred, p01_pred, p11_pred, t]
+    ).rename(band_names)
+
+    if observation is None:
+        return predicted.set("system:time_start", date.millis())
+
+    # update step where there are observations
+    z = ee.Image(observation).select([0])
+    s = p00_pred.add(observation_noise)
+    k0 = p00_pred.divide(s)
+    k1 = p01_pred.divide(s)
+    innovation = z.subtract(level_pred)
+
+    updated = ee.Image.cat(
+        [
+            level_pred.add(k0.multiply(innovation)),
+            trend.add(k1.multiply(innovation)),
+            p00_pred.multiply(ee.Image.constant(1).subtract(k0)),
+            p01_pred.multiply(ee.Image.constant(1).subtract(k0)),
+            p11_pred.subtract(k1.multiply(p01_pred)),
+            t,
+        ]
+    ).rename(band_names)
+
+    return predicted.where(z.mask().gt(0), updated).set(
+        "system:time_start", date.millis()
+    )
+
+
+def decimal_years(times):
+    """Helper function to convert dates to the fractional years since 1970-01-01 used for the "time" band
+    Mirrors `ee.Date.difference(ee.Date("1970-01-01"), "year")` where the fraction is relative to the length of each calendar year
+
+    args:
+        times (numpy.ndarray | list): array of numpy.datetime64 or datetime.datetime values. Numeric arrays are
+            assumed to already be fractional years and are returned as float
+
+    returns:
+        numpy.ndarray: array of fractional years since 1970-01-01
+    """
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.number):
+        return times.astype(np.float64)
+
+    times = times.astype("datetime64[ms]")
+    year_start = times.astype("datetime64[Y]")
+    year_end = year_start + np.timedelta64(1, "Y")
+    fraction = (times - year_start.astype("datetime64[ms]")) / (
+        year_end.astype("datetime64[ms]") - year_start.astype("datetime64[ms]")
+    )
+    return (year_start.astype(np.int64) + fraction).astype(np.float64)
+
+
+def harmonic_design_matrix(times, n_cycles=2):
+    """Function to create the design matrix for local harmonic regression with the same columns as
+    `prep_inputs` and `add_harmonic_coefs` create for images, i.e. constant, time, cos_n, sin_n.
+    Tables are memoized by dates and n_cycles so repeated fits and predictions over the same dates reuse
+    the sin/cos values, the returned matrix is read-only
+
+    args:
+        times (numpy.ndarray | list): dates of observations, see `decimal_years()`
+        n_cycles (int, optional): number of interannual cycles to include. default = 2
+
+    returns:
+        tuple[list[str], numpy.ndarray]: column names and design matrix with shape (time, columns)
+    """
+    t = decimal_years(times)
+    names, x = _harmonic_design_table(t.tobytes(), n_cycles)
+
+    return list(names), x
+
+
+@functools.lru_cache(maxsize=64)
+def _harmonic_design_table(t_bytes, n_cycles):
+    """Private helper function to build the harmonic design matrix for fractional years stored as bytes
+    so that the table can be memoized
+    """
+    t = np.frombuffer(t_bytes, dtype=np.float64)
+    names = (
+        ["constant", "time"]
+        + [f"cos_{i}" for i in range(1, n_cycles + 1)]
+        + [f"sin_{i}" for i in range(1, n_cycles + 1)]
+    )
+
+    time_radians = t[:, np.newaxis] * (2 * math.pi) * np.arange(1, n_cycles + 1)
+    x = np.concatenate(
+        [
+            np.ones((t.size, 1)),
+            t[:, np.newaxis],
+            np.cos(time_radians),
+            np.sin(time_radians),
+        ],
+        axis=1,
+    )
+    x.setflags(write=False)
+
+    return tuple(names), x
+
+
+def fit_harmonic_trend_local(
+    stack,
+    times,
+    mask=None,
+    n_cycles=2,
+    output_err=False,
+    chunk_size=2 ** 18,
+    group_masks=True,
+    output_stats=False,
+    sufficient_stats=None,
+):
+    """Function to fit a harmonic trend on a local (time, y, x) array along the time dimension.
+    Local equivalent of `fit_harmonic_trend`, all pixels within a spatial chunk are solved at once
+    with batched normal equations
+
+    args:
+        stack (numpy.ndarray | None): array of values to fit with shape (time, y, x). Can be a memory-mapped array.
+            Can be None if `sufficient_stats` is provided to only re-derive the coefficients
+        times (numpy.ndarray | list): dates of the observations along the first axis of stack, see `decimal_years()`
+        mask (numpy.ndarray | None, optional): boolean array with same shape as stack where True is a valid observation.
+            If None then all finite values are valid. default = None
+        n_cycles (int, optional): number of interannual cycles to model. default = 2
+        output_err (bool, optional): switch to output regression x and y errors, if true output will have "mean_x", "residual_x" and "residual_y" arrays.
+            Useful for estimating confidence intervals. default = False
+        chunk_size (int, optional): approximate number of pixels to solve at one time. default = 2**18
+        group_masks (bool, optional): switch to group pixels with identical valid observation patterns and solve each group
+            with one shared factorization. Not used when `output_stats` or `sufficient_stats` are set. default = True
+        output_stats (bool, optional): switch to output the sufficient statistics of the fit as "xtx", "xty" and "yy" arrays
+            so that the fit can be updated with new observations later. default = False
+        sufficient_stats (dict | None, optional): sufficient statistics from a previous fit with "xtx", "xty", "n" and "yy" keys.
+            New observations in stack are added to the statistics before solving so the historical observations are not needed. default = None
+
+    returns:
+        dict[str, numpy.ndarray]: regression coeffients as (y, x) arrays keyed "constant", "time", "cos_n", and "sin_n" where n is a sequnces of cycles
+            and "n" as the number of valid observations. Will have "mean_x", "residual_x" and "residual_y" if ouput_err == True
+            and "xtx" (y, x, k, k), "xty" (y, x, k) and "yy" (y, x) if output_stats == True.
+            Pixels with fewer valid observations than coefficients are NaN
+
+    raises:
+        ValueError: if the length of times does not match the first dimension of stack
+            or if neither stack nor sufficient_stats is provided
+    """
+    if stack is None and sufficient_stats is None:
+        raise ValueError(
+            "either stack or sufficient_stats needs to be provided to fit a harmonic trend"
+        )
+
+    names, x = harmonic_design_matrix(
+        [] if times is None else times, n_cycles=n_cycles
+    )
+
+    if output_stats or sufficient_stats is not None:
+        stats = sufficient_stats_local(stack, x, mask, chunk_size)
+        if sufficient_stats is not None:
+            stats = (
+                {k: stats[k] + sufficient_stats[k] for k in stats}
+                if stats is not None
+                else sufficient_stats
+            )
+        out = _solve_sufficient_stats(stats, names, output_err)
+        if output_stats:
+            out.update({k: stats[k] for k in ["xtx", "xty", "yy"]})
+        return out
+
+    return _fit_local(stack, x, names, mask, output_err, chunk_size, group_masks)
+
+
+def fit_linear_trend_local(
+    stack,
+    times,
+    mask=None,
+    output_err=False,
+    chunk_size=2 ** 18,
+    group_masks=True,
+    regression_method="ols",
+    max_pairs=None,
+    seed=0,
+):
+    """Function to fit a linear trend on a local (time, y, x) array along the time dimension.
+    Local equivalent of `fit_linear_trend` with "constant" and "time" independents
+
+    args:
+        stack (numpy.ndarray): array of values to fit with shape (time, y, x). Can be a memory-mapped array
+        times (numpy.ndarray | list): dates of the observations along the first axis of stack, see `decimal_years()`
+        mask (numpy.ndarray | None, optional): boolean array with same shape as stack where True is a valid observation.
+            If None then all finite values are valid. default = None
+        output_err (bool, optional): switch to output regression x and y errors, if true output will have "mean_x", "residual_x" and "residual_y" arrays.
+            Useful for estimating confidence intervals. Not used for "sen" regression. default = False
+        chunk_size (int, optional): approximate number of pixels to solve at one time. default = 2**18
+        group_masks (bool, optional): switch to group pixels with identical valid observation patterns and solve each group
+            with one shared factorization. Only used for "ols" regression. default = True
+        regression_method (str, optional): name of regression to use. Options are "ols", "sen" for the Theil-Sen median
+            of pairwise slopes or "robust" for iteratively reweighted least squares with the Talwar cost function. default = "ols"
+        max_pairs (int | None, optional): maximum number of observation pairs to use for "sen" regression. If the series has more pairs
+            one random sample of pairs is shared by all pixels, the estimated slope is within +/- 1.36/sqrt(m) in quantile of the exact
+            median pairwise slope at 95% confidence where m is the number of sampled pairs with both observations valid. Pairs with
+            masked observations are dropped after sampling so m is smaller than max_pairs for gappy pixels.
+            If None then all pairs are used, note that the time and memory
+            per pixel grow with the square of the number of observations. default = None
+        seed (int, optional): random seed used to sample pairs when max_pairs is set. default = 0
+
+    returns:
+        dict[str, numpy.ndarray]: regression coeffients as (y, x) arrays keyed "constant" and "time" and "n" as the number of valid observations.
+            Will have "mean_x", "residual_x" and "residual_y" if ouput_err == True
+
+    raises:
+        ValueError: if the length of times does not match the first dimension of stack or regression_method is not a valid option
+    """
+    t = decimal_years(times)
+    x = np.stack([np.ones_like(t), t], axis=1)
+
+    if regression_method == "ols":
+        return _fit_local(
+            stack, x, ["constant", "time"], mask, output_err, chunk_size, group_masks
+        )
+    elif regression_method in ("sen", "robust"):
+        return _fit_robust_local(
+            stack, x, regression_method, mask, output_err, chunk_size, max_pairs, seed
+        )
+    else:
+        raise ValueError(
+            f"regression_method must be one of 'ols', 'sen' or 'robust', got '{regression_method}'"
+        )
+
+
+def sufficient_stats_local(stack, x, mask=None, chunk_size=2 ** 18):
+    """Function to calculate the per-pixel sufficient statistics of a least squares regression
+    Statistics from different sets of observations can be added together to update a fit
+
+    args:
+        stack (numpy.ndarray | None): array of values to fit with shape (time, y, x). Can be a memory-mapped array
+        x (numpy.ndarray): design matrix with shape (time, columns), see `harmonic_design_matrix()`
+        mask (numpy.ndarray | None, optional): boolean array with same shape as stack where True is a valid observation.
+            If None then all finite values are valid. default = None
+        chunk_size (int, optional): approximate number of pixels to process at one time. default = 2**18
+
+    returns:
+        dict[str, numpy.ndarray] | None: statistics with keys "xtx" (y, x, k, k), "xty" (y, x, k), "n" (y, x) and "yy" (y, x).
+            None if stack is None or has no observations
+    """
+    if stack is None or stack.shape[0] == 0:
+        return None
+
+    if stack.ndim != 3 or stack.shape[0] != x.shape[0]:
+        raise ValueError(
+            f"stack expected to have shape ({x.shape[0]}, y, x) to match times, got {stack.shape}"
+        )
+
+    n_times, n_rows, n_cols = stack.shape
+    k = x.shape[1]
+    stats = {
+        "xtx": np.zeros((n_rows, n_cols, k, k)),
+        "xty": np.zeros((n_rows, n_cols, k)),
+        "n": np.zeros((n_rows, n_cols)),
+        "yy": np.zeros((n_rows, n_cols)),
+    }
+
+    step = max(1, chunk_size // n_cols)
+    for r0 in range(0, n_rows, step):
+        rows = slice(r0, min(r0 + step, n_rows))
+        y = np.asarray(stack[:, rows, :], dtype=np.float64).reshape(n_times, -1)
+        if mask is None:
+            valid = np.isfinite(y)
+        else:
+            valid = np.asarray(mask[:, rows, :]).reshape(n_times, -1) & np.isfinite(y)
+
+        w = valid.astype(np.float64)
+        y = np.where(valid, y, 0)
+
+        stats["xtx"][rows] = np.einsum("tk,tp,tl->pkl", x, w, x, optimize=True).reshape(
+            -1, n_cols, k, k
+        )
+        stats["xty"][rows] = np.einsum("tk,tp->pk", x, y, optimize=True).reshape(
+            -1, n_cols, k
+        )
+        stats["n"][rows] = w.sum(axis=0).reshape(-1, n_cols)
+        stats["yy"][rows] = np.einsum("tp,tp->p", y, y).reshape(-1, n_cols)
+
+    return stats
+
+
+def daily_dates(start_time, end_time):
+    """Helper function to create daily dates between start_time and end_time for local predictions.
+    Local equivalent of `get_dummy_collection()` without creating any images
+
+    args:
+        start_time (str | numpy.datetime64 | datetime.date): date to start on (inclusive)
+        end_time (str | numpy.datetime64 | datetime.date): date to end on (exclusive)
+
+    returns:
+        numpy.ndarray: array of numpy.datetime64 days
+    """
+    return np.arange(
+        np.datetime64(start_time, "D"),
+        np.datetime64(end_time, "D"),
+        np.timedelta64(1, "D"),
+    )
+
+
+def predict_harmonics_local(coefs, times, n_cycles=2, batch_size=1, dtype=np.float32):
+    """Generator to apply harmonic trend prediction on local coefficient arrays one batch of dates at a time.
+    Local equivalent of `predict_harmonics()`, the sin/cos basis is computed once for all dates and only
+    one batch of predictions is in memory at a time so long daily series can be streamed to disk, i.e.:
+
+        >>> dates = hf.timeseries.daily_dates("2010-01-01", "2020-01-01")
+        >>> out = np.lib.format.open_memmap("climatology.npy", "w+", np.float32, (dates.size,) + shape)
+        >>> for i, (t, pred) in enumerate(hf.timeseries.predict_harmonics_local(coefs, dates, batch_size=32)):
+        ...     out[i * 32 : i * 32 + t.size] = pred
+
+    args:
+        coefs (dict[str, numpy.ndarray] | numpy.ndarray): harmonic coefficients as returned from `fit_harmonic_trend_local()`
+            or an array with shape (coefficients, y, x) ordered constant, time, cos_n, sin_n
+        times (numpy.ndarray | list): dates to predict, see `decimal_years()` and `daily_dates()`
+        n_cycles (int, optional): number of interannual cycles to model, note n_cycles must equal
+            the number of cycle coefficients in `coefs`. default = 2
+        batch_size (int, optional): number of dates to predict per iteration. default = 1
+        dtype (numpy.dtype, optional): data type of predicted arrays. default = numpy.float32
+
+    yields:
+        tuple[numpy.ndarray, numpy.ndarray]: dates of the batch and predicted values with shape (batch, y, x)
+
+    raises:
+        ValueError: if the number of coefficients does not match n_cycles
+    """
+    times = np.asarray(times)
+    names, basis = harmonic_design_matrix(times, n_cycles=n_cycles)
+
+    if isinstance(coefs, dict):
+        coefs = np.stack([coefs[name] for name in names])
+    coefs = np.asarray(coefs, dtype=dtype)
+
+    if coefs.shape[0] != len(names):
+        raise ValueError(
+            f"Expected {len(names)} coefficients for n_cycles={n_cycles}, got {coefs.shape[0]}"
+        )
+
+    basis = basis.astype(dtype)
+    for i in range(0, times.size, batch_size):
+        yield times[i : i + batch_size], np.tensordot(
+            basis[i : i + batch_size], coefs, axes=(1, 0)
+        )
+
+
+def temporal_smoothing_local(
+    stack, times, reducer="mean", days=10, mask=None, chunk_size=2 ** 12
+):
+    """Function to apply moving window reducer in time on a local (time, y, x) array.
+    Local equivalent of `temporal_smoothing()` with the same [t + (-days)//2, t + days//2) window around each observation,
+    for odd days the window extends one more day before t than after.
+    Windows are found from the (possibly irregular) times with one binary search. Mean, sum and count are computed
+    from running sums so their cost grows linearly with the number of observations. Median, min and max use a sorted
+    window that is updated as observations enter and leave, each update shifts the buffer once so their cost grows with
+    the number of observations times the maximum number of observations in a window, instead of sorting every window
+
+    args:
+        stack (numpy.ndarray): array of values to smooth with shape (time, y, x)
+        times (numpy.ndarray | list): numpy.datetime64 or datetime.datetime dates of observations along the first axis of stack
+            in increasing order. Numeric values are assumed to be days
+        reducer (str, optional): name of reducer to apply within window. Options are "mean", "sum", "count",
+            "median", "min" or "max". default = "mean"
+        days (int, optional): size of moving time window in days to apply reducer, must be at least 2
+            so the window includes t. default = 10
+        mask (numpy.ndarray | None, optional): boolean array with same shape as stack where True is a valid observation.
+            If None then all finite values are valid. default = None
+        chunk_size (int, optional): approximate number of pixels to process at one time. default = 2**12
+
+    returns:
+        numpy.ndarray: array with shape of stack with reducer applied in time. Windows without valid observations are NaN
+            (0 for "sum" and "count")
+
+    raises:
+        ValueError: if reducer is not a valid option, days is less than 2 or times are not increasing
+    """
+    running = ("mean", "sum", "count")
+    ordered = ("median", "min", "max")
+    if reducer not in running + ordered:
+        raise ValueError(
+            f"reducer must be one of {running + ordered}, got '{reducer}'"
+        )
+    if days < 2:
+        raise ValueError(
+            f"days must be at least 2 so windows include their own observation, got {days}"
+        )
+
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.number):
+        t = times.astype(np.float64)
+    else:
+        t = (times.astype("datetime64[ms]") - np.datetime64("1970-01-01", "ms")) / np.timedelta64(1, "D")
+    if np.any(np.diff(t) < 0):
+        raise ValueError("times must be in increasing order")
+
+    lo = np.searchsorted(t, t + (-days // 2), side="left")
+    hi = np.searchsorted(t, t + days // 2, side="left")
+
+    n_times, n_rows, n_cols = stack.shape
+    out = np.empty(stack.shape, dtype=np.float64)
+    step = max(1, chunk_size // n_cols)
+
+    for r in range(0, n_rows, step):
+        rows = slice(r, min(r + step, n_rows))
+        y = stack[:, rows].reshape(n_times, -1).astype(np.float64)
+        valid = np.isfinite(y)
+        if mask is not None:
+            valid &= mask[:, rows].reshape(n_times, -1)
+
+        if reducer in running:
+            counts = np.zeros((n_times + 1, y.shape[1]))
+            np.cumsum(valid, axis=0, out=counts[1:])
+            window_counts = counts[hi] - counts[lo]
+            if reducer == "count":
+                result = window_counts
+            else:
+                sums = np.zeros((n_times + 1, y.shape[1]))
+                np.cumsum(np.where(valid, y, 0), axis=0, out=sums[1:])
+                result = sums[hi] - sums[lo]
+                if reducer == "mean":
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        result = np.where(window_counts > 0, result / window_counts, np.nan)
+        else:
+            result = _sorted_window_reduce(
+                np.where(valid, y, np.nan), lo, hi, reducer
+            )
+
+        out[:, rows] = result.reshape(n_times, -1, n_cols)
+
+    return out
+
+
+def init_trend_state_local(shape, date, level_variance=1.0, trend_variance=0.01):
+    """Function to create an initial state for the local recursive linear trend model, see `init_trend_state()`.
+    States are dictionaries of arrays so they can be persisted between runs with `numpy.savez(path, **state)`
+    and reloaded with `dict(numpy.load(path))`
+
+    args:
+        shape (tuple): shape of the state arrays, i.e. (y, x)
+        date (numpy.datetime64 | datetime.datetime | str | float): date the state is valid for, numeric values are days since 1970-01-01
+        level_variance (float, optional): initial variance of the level. default = 1.0
+        trend_variance (float, optional): initial variance of the trend (units per day). default = 0.01
+
+    returns:
+        dict[str, numpy.ndarray]: state arrays with level, trend, p00, p01, p11 and time keys
+    """
+    return {
+        "level": np.zeros(shape),
+        "trend": np.zeros(shape),
+        "p00": np.full(shape, level_variance, dtype=np.float64),
+        "p01": np.zeros(shape),
+        "p11": np.full(shape, trend_variance, dtype=np.float64),
+        "time": np.full(shape, _days_since_epoch(date)),
+    }
+
+
+def kalman_trend_update_local(
+    state, observation, date, process_noise=1e-4, observation_noise=1e-2
+):
+    """Function to recursively update the local linear trend state with a new observation, see `kalman_trend_update()`.
+    Each update costs O(1) per pixel regardless of how many observations have been assimilated
+
+    args:
+        state (dict[str, numpy.ndarray]): state arrays with level, trend, p00, p01, p11 and time keys,
+            see `init_trend_state_local()`
+        observation (numpy.ndarray | None): array of new observations with the same shape as the state, NaN values
+            are treated as masked. If None then only the prediction step is applied
+        date (numpy.datetime64 | datetime.datetime | str | float): date of observation, numeric values are days since 1970-01-01
+        process_noise (float, optional): spectral density of the random trend changes (units per day^2). default = 1e-4
+        observation_noise (float, optional): variance of the observations. default = 1e-2
+
+    returns:
+        dict[str, numpy.ndarray]: updated state arrays
+    """
+    t = _days_since_epoch(date)
+    dt = t - state["time"]
+    q = process_noise
+
+    level = state["level"] + state["trend"] * dt
+    trend = state["trend"].copy()
+    p00 = (
+        state["p00"]
+        + 2 * dt * state["p01"]
+        + dt ** 2 * state["p11"]
+        + q * dt ** 3 / 3
+    )
+    p01 = state["p01"] + dt * state["p11"] + q * dt ** 2 / 2
+    p11 = state["p11"] + q * dt
+
+    if observation is not None:
+        observation = np.asarray(observation, dtype=np.float64)
+        valid = np.isfinite(observation)
+
+        s = p00 + observation_noise
+        k0 = np.where(valid, p00 / s, 0)
+        k1 = np.where(valid, p01 / s, 0)
+        innovation = np.where(valid, observation - level, 0)
+
+        level = level + k0 * innovation
+        trend = trend + k1 * innovation
+        p11 = p11 - k1 * p01
+        p00 = (1 - k0) * p00
+        p01 = (1 - k0) * p01
+
+    return {
+        "level": level,
+        "trend": trend,
+        "p00": p00,
+        "p01": p01,
+        "p11": p11,
+        "time": np.broadcast_to(t, level.shape).astype(np.float64),
+    }
+
+
+def _sorted_window_reduce(y, lo, hi, reducer):
+    """Private helper function to apply an order statistic reducer over moving windows [lo, hi) of the time axis.
+    Keeps one sorted buffer per pixel padded with inf where each new observation is inserted and each
+    expired observation is removed with a single shift, vectorized over all pixels. NaN values are skipped
+    """
+    n_times, n_pixels = y.shape
+    capacity = max(int((hi - lo).max()), 1)
+    buffer = np.full((capacity, n_pixels), np.inf)
+    count = np.zeros(n_pixels, dtype=np.int64)
+    out = np.full((n_times, n_pixels), np.nan)
+
+    first, last = 0, 0
+    for i in range(n_times):
+        # remove observations that left the window, values >= x shift down one position
+        while first < min(lo[i], last):
+            x = np.where(np.isnan(y[first]), np.inf, y[first])
+            count -= np.isfinite(x)
+            keep = buffer < x
+            tail = np.where(keep[-1], buffer[-1], np.inf)
+            buffer[:-1] = np.where(keep[:-1], buffer[:-1], buffer[1:])
+            buffer[-1] = tail
+            first += 1
+        first = max(first, lo[i])
+        last = max(last, first)
+
+        # insert observations that entered the window, values >= x shift up one position
+        while last < hi[i]:
+            x = np.where(np.isnan(y[last]), np.inf, y[last])
+            count += np.isfinite(x)
+            keep = buffer < x
+            shifted = np.where(keep[:-1], x, buffer[:-1])
+            buffer[0] = np.where(keep[0], buffer[0], x)
+            buffer[1:] = np.where(keep[1:], buffer[1:], shifted)
+            last += 1
+
+        if reducer == "min":
+            values = buffer[0]
+        elif reducer == "max":
+            values = np.take_along_axis(buffer, np.maximum(count - 1, 0)[np.newaxis], 0)[0]
+        else:
+            lower = np.take_along_axis(buffer, np.maximum((count - 1) // 2, 0)[np.newaxis], 0)[0]
+            upper = np.take_along_axis(buffer, np.minimum(count // 2, capacity - 1)[np.newaxis], 0)[0]
+            values = (lower + upper) / 2
+        out[i] = np.where(count > 0, values, np.nan)
+
+    return out
+
+
+def _days_since_epoch(date):
+    """Private helper function to convert a date to days since 1970-01-01. Numeric values are returned as is
+    """
+    if isinstance(date, (int, float, np.number)):
+        return float(date)
+
+    return float(
+        (np.datetime64(date, "ms") - np.datetime64("1970-01-01", "ms"))
+        / np.timedelta64(1, "D")
+    )
+
+
+def _solve_sufficient_stats(stats, names, output_err=False):
+    """Private helper function to solve for coefficients and error terms from sufficient statistics.
+    Expects the first two columns of the design matrix are constant and time
+    """
+    n_rows, n_cols, k, _ = stats["xtx"].shape
+    xtx = stats["xtx"].reshape(-1, k, k).copy()
+    xty = stats["xty"].reshape(-1, k).copy()
+    n = stats["n"].ravel()
+
+    solvable = n >= k
+    xtx[~solvable] = np.eye(k)
+    xty[~solvable] = 0
+
+    beta = _cholesky_solve(xtx, xty)
+    beta[~solvable] = np.nan
+
+    out = {name: beta[:, i].reshape(n_rows, n_cols) for i, name in enumerate(names)}
+    out["n"] = stats["n"].copy()
+
+    if output_err:
+        # sse = y'y - 2b'X'y + b'X'Xb
+        sse = (
+            stats["yy"].ravel()
+            - 2 * np.einsum("pk,pk->p", beta, xty)
+            + np.einsum("pk,pkl,pl->p", beta, xtx, beta)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            residual_y = np.sqrt(np.maximum(sse, 0) / n)
+            mean_x = stats["xtx"][..., 0, 1].ravel() / n
+        residual_x = stats["xtx"][..., 1, 1].ravel() - n * mean_x ** 2
+
+        out["residual_y"] = residual_y.reshape(n_rows, n_cols)
+        out["mean_x"] = mean_x.reshape(n_rows, n_cols)
+        out["residual_x"] = residual_x.reshape(n_rows, n_cols)
+
+    return out
+
+
+def _fit_local(
+    stack, x, names, mask=None, output_err=False, chunk_size=2 ** 18, group_masks=True
+):
+    """Private helper function to solve the per-pixel least squares regression of stack on the design matrix x
+    by chunks of rows, mirroring the outputs of `ee.Reducer.linearRegression` used in the ee time series functions
+    """
+    if stack.ndim != 3 or stack.shape[0] != x.shape[0]:
+        raise ValueError(
+            f"stack expected to have shape ({x.shape[0]}, y, x) to match times, got {stack.shape}"
+        )
+
+    n_times, n_rows, n_cols = stack.shape
+    out_names = names + ["n"]
+    if output_err:
+        out_names += ["residual_y", "mean_x", "residual_x"]
+    out = {name: np.full((n_rows, n_cols), np.nan) for name in out_names}
+
+    step = max(1, chunk_size // n_cols)
+    for r0 in range(0, n_rows, step):
+        rows = slice(r0, min(r0 + step, n_rows))
+        y = np.asarray(stack[:, rows, :], dtype=np.float64).reshape(n_times, -1)
+        if mask is None:
+            valid = np.isfinite(y)
+        else:
+            valid = np.asarray(mask[:, rows, :]).reshape(n_times, -1) & np.isfinite(y)
+
+        y = np.where(valid, y, 0)
+
+        if group_masks:
+            results = _solve_grouped(x, y, valid, output_err)
+        else:
+            results = _solve_normal_equations(
+                x, y, valid.astype(np.float64), output_err
+            )
+
+        for name, values in zip(out_names, results):
+            out[name][rows] = values.reshape(-1, n_cols)
+
+    return out
+
+
+def _fit_robust_local(
+    stack,
+    x,
+    method="sen",
+    mask=None,
+    output_err=False,
+    chunk_size=2 ** 18,
+    max_pairs=None,
+    seed=0,
+    max_iter=10,
+):
+    """Private helper function to fit per-pixel Theil-Sen or Talwar IRLS linear trends by blocks of pixels.
+    Pairwise slopes are evaluated for a block of pixels at once and reduced with one partition call
+    """
+    if stack.ndim != 3 or stack.shape[0] != x.shape[0]:
+        raise ValueError(
+            f"stack expected to have shape ({x.shape[0]}, y, x) to match times, got {stack.shape}"
+        )
+
+    n_times, n_rows, n_cols = stack.shape
+    t = x[:, 1]
+
+    out_names = ["constant", "time", "n"]
+    if output_err and method != "sen":
+        out_names += ["residual_y", "mean_x", "residual_x"]
+    out = {name: np.full((n_rows, n_cols), np.nan) for name in out_names}
+
+    if method == "sen":
+        i, j = np.triu_indices(n_times, k=1)
+        keep = t[j] != t[i]
+        i, j = i[keep], j[keep]
+        if max_pairs is not None and i.size > max_pairs:
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(i.size, max_pairs, replace=False))
+            i, j = i[sample], j[sample]
+        dt = (t[j] - t[i])[:, np.newaxis]
+        # limit the (pairs, pixels) slope array to ~2**22 values per block,
+        # long series are split within rows so blocks can be narrower than a row
+        block = max(1, min(chunk_size, 2 ** 22 // max(i.size, 1)))
+    else:
+        block = max(1, chunk_size)
+    row_step = max(1, block // n_cols)
+    col_step = min(n_cols, block)
+
+    for r0 in range(0, n_rows, row_step):
+        rows = slice(r0, min(r0 + row_step, n_rows))
+        for c0 in range(0, n_cols, col_step):
+            cols = slice(c0, min(c0 + col_step, n_cols))
+            y = np.asarray(stack[:, rows, cols], dtype=np.float64).reshape(n_times, -1)
+            if mask is None:
+                valid = np.isfinite(y)
+            else:
+                valid = np.asarray(mask[:, rows, cols]).reshape(n_times, -1) & np.isfinite(y)
+            y = np.where(valid, y, 0)
+            n = valid.sum(axis=0).astype(np.float64)
+
+            if method == "sen":
+                slope = _masked_median((y[j] - y[i]) / dt, valid[j] & valid[i])
+                offset = _masked_median(y - t[:, np.newaxis] * slope, valid)
+                results = [offset, slope, n]
+            else:
+                w = valid
+                results = _solve_normal_equations(x, y, w.astype(np.float64), output_err)
+                for _ in range(max_iter):
+                    residuals = np.abs(y - x @ np.stack(results[:2]))
+                    scale = _masked_median(residuals, w) / 0.6745
+                    # talwar weights, observations beyond the tuning constant are dropped
+                    new_w = valid & ~(residuals > 2.795 * scale)
+                    if np.array_equal(new_w, w):
+                        break
+                    w = new_w
+                    results = _solve_normal_equations(
+                        x, y, w.astype(np.float64), output_err
+                    )
+                results[2] = n
+
+            for name, values in zip(out_names, results):
+                out[name][rows, cols] = values.reshape(-1, cols.stop - cols.start)
+
+    return out
+
+
+def _masked_median(values, valid):
+    """Private helper function to calculate the median along the first axis using only valid values.
+    Invalid values are replaced with -inf or inf so that the valid median falls at the same ranks for
+    every column, then all columns are reduced with one quickselect partition. Columns without valid values are NaN
+    """
+    n_values = values.shape[0]
+    n_valid = valid.sum(axis=0)
+    if n_values == 0:
+        return np.full(values.shape[1:], np.nan)
+
+    k = (n_values - 1) // 2
+    if n_valid.min() == n_values:
+        padded = values
+    else:
+        n_low = k - (np.maximum(n_valid, 1) - 1) // 2
+        invalid_rank = np.cumsum(~valid, axis=0, dtype=np.int32)
+        padded = np.where(
+            valid, values, np.where(invalid_rank <= n_low, -np.inf, np.inf)
+        )
+
+    kth = [k, min(k + 1, n_values - 1)]
+    part = np.partition(padded, kth, axis=0)
+    upper = np.where(n_valid % 2 == 0, part[kth[1]], part[k])
+    with np.errstate(invalid="ignore"):
+        median = (part[k] + upper) / 2
+
+    return np.where(n_valid > 0, median, np.nan)
+
+
+def _solve_normal_equations(x, y, w, output_err=False):
+    """Private helper function to solve the weighted normal equations for each column of y.
+    Returns a list of the coefficients, number of observations and optional error terms as flat arrays
+    """
+    n_coefs = x.shape[1]
+    n = w.sum(axis=0)
+
+    # per pixel X'WX with shape (pixels, k, k) and X'Wy with shape (pixels, k)
+    xtx = np.einsum("tk,tp,tl->pkl", x, w, x, optimize=True)
+    xty = np.einsum("tk,tp->pk", x, w * y, optimize=True)
+
+    solvable = n >= n_coefs
+    xtx[~solvable] = np.eye(n_coefs)
+    xty[~solvable] = 0
+
+    beta = _cholesky_solve(xtx, xty)
+    beta[~solvable] = np.nan
+
+    results = [beta[:, i] for i in range(n_coefs)] + [n]
+
+    if output_err:
+        residuals = (y - x @ beta.T) * w
+        with np.errstate(divide="ignore", invalid="ignore"):
+            residual_y = np.sqrt((residuals ** 2).sum(axis=0) / n)
+            mean_x = (x[:, 1, np.newaxis] * w).sum(axis=0) / n
+        residual_x = (((x[:, 1, np.newaxis] - mean_x) * w) ** 2).sum(axis=0)
+        residual_y[~solvable] = np.nan
+        results += [residual_y, mean_x, residual_x]
+
+    return results
+
+
+def _solve_grouped(x, y, valid, output_err=False, min_group_size=8):
+    """Private helper function to solve the regression for pixels grouped by their valid observation pattern.
+    Each pattern shared by at least `min_group_size` pixels is factorized once and the pseudo-inverse is applied
+    to all of the group's pixels with one matrix multiply, remaining pixels are solved with batched normal equations
+    """
+    n_coefs = x.shape[1]
+    n_pixels = y.shape[1]
+
+    # hash the mask pattern of each pixel as bytes of the bit packed time series
+    # bits are packed from whole rows to keep memory access contiguous
+    packed = np.zeros((-(-valid.shape[0] // 8), n_pixels), dtype=np.uint8)
+    for bit in range(8):
+        rows = valid[bit::8].view(np.uint8)
+        packed[: rows.shape[0]] |= rows << (7 - bit)
+    packed = np.ascontiguousarray(packed.T)
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first, inverse, counts = np.unique(
+        keys, return_index=True, return_inverse=True, return_counts=True
+    )
+    inverse = inverse.ravel()
+
+    n_results = n_coefs + (4 if output_err else 1)
+    results = [np.full(n_pixels, np.nan) for _ in range(n_results)]
+
+    # pixels in small groups are solved individually
+    singles = counts[inverse] < min_group_size
+    if singles.any():
+        solved = _solve_normal_equations(
+            x, y[:, singles], valid[:, singles].astype(np.float64), output_err
+        )
+        for result, values in zip(results, solved):
+            result[singles] = values
+
+    order = np.argsort(inverse, kind="stable")
+    splits = np.split(order, np.cumsum(counts)[:-1])
+    for group, pixels in enumerate(splits):
+        if counts[group] < min_group_size:
+            continue
+
+        m = valid[:, first[group]]
+        n = np.count_nonzero(m)
+        xg = x[m]
+        results[n_coefs][pixels] = n
+
+        if output_err and n > 0:
+            mean_x = xg[:, 1].mean()
+            results[n_coefs + 2][pixels] = mean_x
+            results[n_coefs + 3][pixels] = ((xg[:, 1] - mean_x) ** 2).sum()
+
+        if n < n_coefs:
+            continue
+
+        if pixels.size == n_pixels:
+            # avoid copying the chunk when all pixels share one pattern
+            yg = y if n == x.shape[0] else y[m]
+        else:
+            yg = y[np.ix_(m, pixels)]
+        beta = np.linalg.pinv(xg) @ yg
+        for i in range(n_coefs):
+            results[i][pixels] = beta[i]
+
+        if output_err:
+            residuals = xg @ beta
+            residuals -= yg
+            results[n_coefs + 1][pixels] = np.sqrt(
+                np.einsum("tp,tp->p", residuals, residuals) / n
+            )
+
+    return results
+
+
+def _cholesky_solve(a, b):
+    """Private helper function to solve a batch of symmetric positive definite systems a @ x = b
+    with a batched Cholesky factorization and vectorized forward/back substitution.
+    Falls back to the pseudo-inverse if any system in the batch is not positive definite
+    """
+    try:
+        lower = np.linalg.cholesky(a)
+    except np.linalg.LinAlgError:
+        return np.einsum("pkl,pl->pk", np.linalg.pinv(a), b)
+
+    k = b.shape[1]
+    z = np.empty_like(b)
+    for i in range(k):
+        z[:, i] = (b[:, i] - np.einsum("pj,pj->p", lower[:, i, :i], z[:, :i])) / lower[
+            :, i, i
+        ]
+    x = np.empty_like(b)
+    for i in reversed(range(k)):
+        x[:, i] = (
+            z[:, i] - np.einsum("pj,pj->p", lower[:, i + 1 :, i], x[:, i + 1 :])
+        ) / lower[:, i, i]
+
+    return x
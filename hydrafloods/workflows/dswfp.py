@@ -206,7 +206,9 @@ def export_surface_water_harmonics(
     output_asset_path=None,
     output_bucket=None,
     tile=False,
-    tile_size=1.0
+    tile_size=1.0,
+    output_stats=False,
+    sufficient_stats=None,
 ):
 
     if tile:
@@ -226,7 +228,7 @@ def export_surface_water_harmonics(
             if output_asset_path is not None:
                 output_tile_path = output_asset_path + f"harmonics_t{i:05d}"
 
-            export_harmonics(
+            export_surface_water_harmonics(
                 region=grid_tile,
                 start_time=start_time,
                 end_time=end_time,
@@ -235,9 +237,11 @@ def export_surface_water_harmonics(
                 fusion_samples=fusion_samples,
                 fusion_model_asset=fusion_model_asset,
                 output_asset_path=output_tile_path,
-                output_bucket_path=output_bucket,
+                output_bucket=output_bucket,
                 tile=False,
-                tile_size=tile_size
+                tile_size=tile_size,
+                output_stats=output_stats,
+                sufficient_stats=sufficient_stats,
             )
 
     else:
@@ -278,9 +282,28 @@ def export_surface_water_harmonics(
             }
         )
 
+        if sufficient_stats is not None:
+            # keep the start of the historical archive the statistics were calculated from
+            sufficient_stats = ee.Image(sufficient_stats)
+            metadata = metadata.set(
+                "fit_time_start", sufficient_stats.get("fit_time_start")
+            )
+
         harmonic_coefs = timeseries.fit_harmonic_trend(
-            ds, dependent=label, output_err=True
+            ds,
+            dependent=label,
+            output_err=True,
+            output_stats=output_stats,
+            sufficient_stats=sufficient_stats,
         )
+
+        if output_stats:
+            harmonic_stats = harmonic_coefs.select(["xtx", "xty", "n", "yy"]).set(
+                metadata
+            )
+            harmonic_coefs = harmonic_coefs.select(
+                harmonic_coefs.bandNames().removeAll(["xtx", "xty", "yy"])
+            )
         harmonic_coefs = harmonic_coefs.divide(scale_factor).int32().set(metadata)
 
         if output_asset_path is not None:
@@ -292,6 +315,16 @@ def export_surface_water_harmonics(
                 scale=10,
                 crs="EPSG:4326",
             )
+            if output_stats:
+                geeutils.export_image(
+                    harmonic_stats,
+                    region,
+                    output_asset_path + "_stats",
+                    description=f"hydrafloods_harmonic_stats_export_{time_id}",
+                    scale=10,
+                    crs="EPSG:4326",
+                    pyramiding={".default": "sample"},
+                )
         elif output_bucket is not None:
             raise NotImplementedError()
         else:
@@ -302,6 +335,30 @@ def export_surface_water_harmonics(
     return
 
 
+def _uniform_sum_exceedance(mean, half_width_a, half_width_b, threshold):
+    """Private helper function to calculate the probability that mean + U(-a, a) + U(-b, b) is greater than threshold
+    for independent uniform errors, using the trapezoidal distribution of the sum of two uniform variables
+    """
+    p = half_width_a.max(half_width_b).max(1e-9)
+    q = half_width_a.min(half_width_b).max(1e-9)
+
+    s = mean.multiply(-1).add(threshold)
+    s_abs = s.abs()
+
+    # probability of exceeding |s| on the linear center and quadratic tail of the distribution
+    center = ee.Image.constant(0.5).subtract(s_abs.divide(p.multiply(2)))
+    tail = p.add(q).subtract(s_abs).pow(2).divide(p.multiply(q).multiply(8))
+
+    # start from the inputs so pixels masked in any of them stay masked
+    upper = (
+        s.add(p).add(q).multiply(0)
+        .where(s_abs.lt(p.add(q)), tail)
+        .where(s_abs.lt(p.subtract(q)), center)
+    )
+
+    return upper.where(s.lt(0), ee.Image.constant(1).subtract(upper))
+
+
 def export_daily_surface_water(
     region,
     target_date,
@@ -321,6 +378,12 @@ def export_daily_surface_water(
     tile=False,
     tile_size=1.0,
     tile_buffer=100000,
+    threshold_cache=None,
+    residual_model="linear",
+    residual_state=None,
+    output_state_path=None,
+    process_noise=1e-4,
+    observation_noise=1e-2,
 ):
     def get_weights(i):
         i = ee.Number(i)
@@ -335,10 +398,8 @@ def export_daily_surface_water(
             .qualityMosaic(label)
         )
 
-        time_img = timeseries.get_dummy_img(new_date)
-
         harmon_pred = (
-            timeseries.add_harmonic_coefs(time_img)
+            timeseries.harmonic_basis(new_date)
             .multiply(harmonic_coefs)
             .reduce("sum")
         )
@@ -347,24 +408,6 @@ def export_daily_surface_water(
 
         return harmon_diff.set("system:time_start", new_date.millis())
 
-    def calc_confidence(i):
-        i = ee.Number(i)
-        # uniform sampling of std dev at 95% confidence interval
-        long_term_seed = i.add(500)
-        short_term_seed = i.add(1000)
-        long_term_random = ee.Image.random(long_term_seed).multiply(3.92).subtract(1.96)
-        short_term_random = (
-            ee.Image.random(short_term_seed).multiply(3.92).subtract(1.96)
-        )
-
-        lin_sim = lin_pred.add(short_term_random.multiply(linCi))
-        har_sim = har_pred.add(long_term_random.multiply(harCi))
-
-        sim_pred = har_sim.subtract(lin_sim)
-        # random_water = thresholding.bmax_otsu(random_combination,invert=True)
-        # naive estimate of water (>0)
-        return sim_pred.gt(ci_threshold).uint8()
-
     if tile:
         if tile:
             land_area = (
@@ -387,6 +430,10 @@ def export_daily_surface_water(
                     output_bucket_tile = output_bucket_path + f"_tile{i:05d}"
                 else:
                     output_bucket_tile = None
+                if output_state_path is not None:
+                    output_state_tile = output_state_path + f"_tile{i:05d}"
+                else:
+                    output_state_tile = None
 
                 grid_tile = ee.Feature(grid_list.get(i)).geometry()
                 export_daily_surface_water(
@@ -407,12 +454,26 @@ def export_daily_surface_water(
                     initial_threshold=initial_threshold,
                     tile=False,
                     tile_buffer=tile_buffer,
+                    threshold_cache=threshold_cache,
+                    residual_model=residual_model,
+                    residual_state=residual_state,
+                    output_state_path=output_state_tile,
+                    process_noise=process_noise,
+                    observation_noise=observation_noise,
                 )
 
     else:
+        if residual_model not in ("linear", "kalman"):
+            raise ValueError(
+                f"residual_model must be one of 'linear' or 'kalman', got '{residual_model}'"
+            )
 
         end_time = ee.Date(target_date).advance(-(lag - 1), "day")
-        start_time = end_time.advance(-look_back, "day")
+        if residual_model == "kalman":
+            # recursive model only needs the newest day of observations
+            start_time = end_time.advance(-1, "day")
+        else:
+            start_time = end_time.advance(-look_back, "day")
 
         if fusion_samples is not None:
             fusion_model, scaling_dict = ml.random_forest_ee(
@@ -469,22 +530,55 @@ def export_daily_surface_water(
 
         dummy_target = timeseries.get_dummy_img(target_date)
 
-        weights = ee.ImageCollection.fromImages(
-            ee.List.sequence(0, look_back - 1).map(get_weights)
-        ).sort("system:time_start")
+        if residual_model == "kalman":
+            obs_date = target_date.advance(-lag, "day")
 
-        weights_lr = timeseries.fit_linear_trend(
-            weights, dependent="residual", output_err=output_confidence
-        )
+            if residual_state is None:
+                residual_state = timeseries.init_trend_state(
+                    obs_date.advance(-1, "day")
+                )
+            elif isinstance(residual_state, ee.ImageCollection):
+                residual_state = residual_state.mosaic()
+            else:
+                residual_state = ee.Image(residual_state)
+
+            # assimilate the newest residual then forecast to the target date
+            new_state = timeseries.kalman_trend_update(
+                residual_state,
+                get_weights(0),
+                obs_date,
+                process_noise=process_noise,
+                observation_noise=observation_noise,
+            )
+            target_state = timeseries.kalman_trend_update(
+                new_state,
+                None,
+                target_date,
+                process_noise=process_noise,
+                observation_noise=observation_noise,
+            )
 
-        weights_coefs = weights_lr.select("^(c|t).*")
+            lin_pred = target_state.select("level").rename("residual_est")
 
-        lin_pred = (
-            dummy_target.multiply(weights_coefs).reduce("sum").rename("residual_est")
-        )
+        else:
+            weights = ee.ImageCollection.fromImages(
+                ee.List.sequence(0, look_back - 1).map(get_weights)
+            ).sort("system:time_start")
+
+            weights_lr = timeseries.fit_linear_trend(
+                weights, dependent="residual", output_err=output_confidence
+            )
+
+            weights_coefs = weights_lr.select("^(c|t).*")
+
+            lin_pred = (
+                dummy_target.multiply(weights_coefs)
+                .reduce("sum")
+                .rename("residual_est")
+            )
 
         har_pred = (
-            timeseries.add_harmonic_coefs(dummy_target)
+            timeseries.harmonic_basis(target_date)
             .multiply(harmonic_coefs)
             .reduce("sum")
         )
@@ -501,6 +595,7 @@ def export_daily_surface_water(
             invert=True,
             scale=150,
             return_threshold=True,
+            cache=threshold_cache,
         )
 
         permanent_water = (
@@ -520,18 +615,22 @@ def export_daily_surface_water(
             water = water.addBands(flood)
 
         if output_confidence:
-            weights_err = weights_lr.select(".*(x|y|n)$")
-
-            linCi = weights_err.expression(
-                "mse * ((1/n) + ((t-xmean)**2/xr))**(1/2)",
-                {
-                    "mse": weights_err.select("residual_y"),
-                    "n": weights_err.select("n"),
-                    "xmean": weights_err.select("mean_x"),
-                    "xr": weights_err.select("residual_x"),
-                    "t": dummy_target.select("time"),
-                },
-            )
+            if residual_model == "kalman":
+                # forecast variance of the level is the uncertainty of the residual estimate
+                linCi = target_state.select("p00").sqrt()
+            else:
+                weights_err = weights_lr.select(".*(x|y|n)$")
+
+                linCi = weights_err.expression(
+                    "mse * ((1/n) + ((t-xmean)**2/xr))**(1/2)",
+                    {
+                        "mse": weights_err.select("residual_y"),
+                        "n": weights_err.select("n"),
+                        "xmean": weights_err.select("mean_x"),
+                        "xr": weights_err.select("residual_x"),
+                        "t": dummy_target.select("time"),
+                    },
+                )
 
             harCi = harmonic_err.expression(
                 "mse * ((1/n) + ((t-xmean)**2/xr))**(1/2)",
@@ -544,11 +643,15 @@ def export_daily_surface_water(
                 },
             )
 
+            # probability that the prediction with uniform errors within the
+            # 95% confidence intervals of both models is above the water threshold
             confidence = (
-                ee.ImageCollection.fromImages(
-                    ee.List.sequence(0, 99).map(calc_confidence)
+                _uniform_sum_exceedance(
+                    har_pred.subtract(lin_pred),
+                    harCi.multiply(1.96),
+                    linCi.multiply(1.96),
+                    ci_threshold,
                 )
-                .reduce(ee.Reducer.mean(), 16)
                 .multiply(100)
                 .uint8()
                 .rename("confidence")
@@ -560,6 +663,25 @@ def export_daily_surface_water(
 
         fused_pred = fused_pred.multiply(10000).int16()
 
+        if residual_model == "kalman" and output_state_path is not None:
+            # persist the state so the next daily run only assimilates one new observation
+            geeutils.export_image(
+                new_state.set(
+                    {
+                        "hf_version": hf.__version__,
+                        "execution_time": time_str,
+                        "process_noise": process_noise,
+                        "observation_noise": observation_noise,
+                    }
+                ),
+                region,
+                output_state_path,
+                description=f"hydrafloods_residual_state_export_{time_id}",
+                scale=10,
+                crs="EPSG:4326",
+                pyramiding={".default": "sample"},
+            )
+
         if output_asset_path is not None:
             # create metadata dict
             metadata = ee.Dictionary(
@@ -570,6 +692,7 @@ def export_daily_surface_water(
                     "execution_time": time_str,
                     "lag": lag,
                     "look_back": look_back,
+                    "residual_model": residual_model,
                 }
             )
             geeutils.export_image(
@@ -24,6 +24,10 @@ setup(name='hydrafloods',
     install_requires=[
         'simplecmr',
         'earthengine-api',
-        'gcsfs'
+        'gcsfs',
+        'numpy>=1.20'
     ],
+    extras_require={
+        'jit': ['numba'],
+    },
 )